@@ -0,0 +1,66 @@
+"""command line parsing for bot commands
+
+split() tokenizes exactly like shlex.split(text, posix=False), which was used before:
+* tokens are separated by space, tab, carriage return and newline
+* a quote at the start of a token begins a quoted token, it ends at the matching quote and
+    keeps both quotes, e.g. '"a b"c' -> ['"a b"', 'c']
+* quotes inside a token are ordinary characters, e.g. 'a"b c' -> ['a"b', 'c']
+* there are no escapes and no comments
+* an unclosed quote at the start of a token raises ValueError("No closing quotation")
+
+tests/conformance-commandparser.py compares it with shlex
+"""
+
+import re
+
+
+_token = re.compile(r"""
+    "[^"]*"             # double-quoted token
+  | '[^']*'             # single-quoted token
+  | [^ \t\r\n"'][^ \t\r\n]*  # word, may contain quotes after its first character
+  | (["'])              # unclosed quote
+""", re.VERBOSE)
+
+
+def split(text):
+    """return the tokens of text, see module docstring"""
+    tokens = []
+    for match in _token.finditer(text):
+        if match.group(1):
+            raise ValueError("No closing quotation")
+        tokens.append(match.group(0))
+    return tokens
+
+
+class CommandParser:
+    """recognise bot aliases, the first word of a message is compared in lower case"""
+
+    def __init__(self, aliases):
+        self.aliases = frozenset(aliases)
+
+    def parse(self, text):
+        """return the tokens of text (see split()) if its first word is a bot alias, else None
+
+        text is tokenized once: the alias check uses the first token, so a message without an
+            alias stops after it. words are separated by any whitespace for the alias check,
+            like text.split(), e.g. "/bot\u2003help" starts with the alias "/bot" but is a
+            single token. an unclosed quote raises ValueError only if there is an alias
+        """
+        tokens = []
+        alias = False
+        for match in _token.finditer(text):
+            if match.group(1):
+                if alias:
+                    raise ValueError("No closing quotation")
+                # the first word starts with the unclosed quote
+                return None
+            token = match.group(0)
+            if not alias:
+                # tokens before the first word only hold whitespace that does not separate tokens
+                words = token.split(None, 1)
+                if words:
+                    if words[0].lower() not in self.aliases:
+                        return None
+                    alias = True
+            tokens.append(token)
+        return tokens if alias else None
@@ -18,6 +18,16 @@ class CommandDispatcher(object):
 
         self.command_tagsets = {}
 
+        # cached results of get_available_commands() per (conv_id, chat_id)
+        self.generation = 0 # changes with the set of commands and their tags
+        self.permissions_maxsize = 10000
+        self._permissions = {}
+        self.permission_hits = 0
+        self.permission_misses = 0
+        self.permission_time_last = 0
+        self.permission_time_max = 0
+        self.permission_time_total = 0
+
     def set_bot(self, bot):
         self.bot = bot
 
@@ -51,6 +61,11 @@ class CommandDispatcher(object):
             tagsets = set([tagsets])
 
         self.command_tagsets[command] = self.command_tagsets[command] | tagsets
+        self.invalidate_permissions()
+
+    def invalidate_permissions(self):
+        """call after changing commands, admin_commands or command_tagsets directly"""
+        self.generation += 1
 
 
     @property
@@ -64,7 +79,51 @@ class CommandDispatcher(object):
         return config_tags_escalate
 
     def get_available_commands(self, bot, chat_id, conv_id):
+        """return the admin and user commands available to chat_id in conv_id
+
+        results are cached until the conversation config, the tags, the loaded commands, the
+            existence of the user or the conversation type change
+        """
+        conv = bot.conversations.catalog.get(conv_id)
+        stamp = ( bot.get_config_view(conv_id).generation,
+                  bot.tags.generation,
+                  self.generation,
+                  bot.memory.exists(["user_data", chat_id]),
+                  conv["type"] if conv else None )
+
+        key = (conv_id, chat_id)
+        cached = self._permissions.get(key)
+        if cached is not None and cached[0] == stamp:
+            self.permission_hits += 1
+            return { "admin": list(cached[1]), "user": list(cached[2]) }
+
+        self.permission_misses += 1
         start_time = time.time()
+        commands = self._get_available_commands(bot, chat_id, conv_id)
+        interval = time.time() - start_time
+
+        self.permission_time_last = interval
+        self.permission_time_max = max(self.permission_time_max, interval)
+        self.permission_time_total += interval
+        logger.debug("get_available_commands() - {}".format(interval))
+
+        if len(self._permissions) >= self.permissions_maxsize:
+            self._permissions.clear()
+        self._permissions[key] = (stamp, frozenset(commands["admin"]), frozenset(commands["user"]))
+
+        return commands
+
+    def permission_stats(self):
+        lookups = self.permission_hits + self.permission_misses
+        return { "hits": self.permission_hits,
+                 "misses": self.permission_misses,
+                 "hit rate": self.permission_hits / lookups if lookups else 0,
+                 "cached": len(self._permissions),
+                 "time.last": self.permission_time_last,
+                 "time.max": self.permission_time_max,
+                 "time.average": self.permission_time_total / self.permission_misses if self.permission_misses else 0 }
+
+    def _get_available_commands(self, bot, chat_id, conv_id):
 
         config_tags_deny_prefix = self.deny_prefix
         config_tags_escalate = self.escalate_tagged
@@ -154,9 +213,6 @@ class CommandDispatcher(object):
 
         user_commands = user_commands - admin_commands # ensure no overlap
 
-        interval = time.time() - start_time
-        logger.debug("get_available_commands() - {}".format(interval))
-
         return { "admin": list(admin_commands), "user": list(user_commands) }
 
     @asyncio.coroutine
@@ -198,6 +254,7 @@ class CommandDispatcher(object):
                 self.commands[func_name] = func
                 if admin:
                     self.admin_commands.append(func_name)
+                self.invalidate_permissions()
 
             else:
                 # just register and return the same function
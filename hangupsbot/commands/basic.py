@@ -1,7 +1,9 @@
+import html
 import logging
 import sys
 import re
 
+import parsers
 import plugins
 
 from version import __version__
@@ -254,6 +256,98 @@ def resourcememory(bot, event, *args):
     yield from bot.coro_send_message(event.conv,  "<b>" + message + "</b>")
 
 
+@command.register(admin=True)
+def eventqueues(bot, event, *args):
+    """show the depth of the per-conversation event queues and what was dropped or delayed"""
+    stats = bot._scheduler.stats()
+    lines = [ "<b>event queues</b>",
+              "pending: {}, conversations: {}, deepest: {}, workers: {}".format(
+                  stats["pending"], stats["conversations"], stats["deepest"], stats["workers"]),
+              "dispatched: {}, shed: {}, released: {}, backpressure waits: {}".format(
+                  stats["dispatched"], stats["shed"], stats["released"], stats["waits"]),
+              "max depth: {}, max pending: {}, max wait: {:.3f}s".format(
+                  stats["max depth"], stats["max pending"], stats["max wait"]) ]
+
+    stats = bot._coalescer.stats()
+    lines.append("status notifications received: {}, delivered: {}, coalesced: {}, waiting: {}".format(
+        stats["received"], stats["delivered"], stats["coalesced"], stats["waiting"]))
+
+    stats = bot._duplicate_filter.stats()
+    lines.append("duplicate events dropped: {} of {}, remembered ids: {}".format(
+        stats["duplicates"], stats["checked"], stats["remembered"]))
+
+    stats = bot._handlers._reprocessors.stats()
+    lines.append("reprocessors active: {}, registered: {}, run: {}, expired: {}, evicted: {}".format(
+        stats["active"], stats["registered"], stats["run"], stats["expired"], stats["evicted"]))
+    yield from bot.coro_send_message(event.conv, "<br />".join(lines))
+
+
+@command.register(admin=True)
+def sendqueues(bot, event, *args):
+    """show the depth of the outbound message queues and the send latency"""
+    stats = bot._outbound.stats()
+    lines = [ "<b>outbound messages</b>",
+              "pending: {}, conversations: {}, deepest: {}, max depth: {}".format(
+                  stats["pending"], stats["conversations"], stats["deepest"], stats["max depth"]),
+              "sending: {}, sent: {}, failed: {}, rate limited: {}, coalesced: {}".format(
+                  stats["sending"], stats["sent"], stats["failed"], stats["throttled"], stats["coalesced"]),
+              "latency last: {:.3f}s, average: {:.3f}s, max: {:.3f}s".format(
+                  stats["latency.last"], stats["latency.average"], stats["latency.max"]) ]
+
+    stats = bot._outbound.retry.stats()
+    lines.append("retries waiting: {}, spooled: {}, retried: {}, resent: {}, dead letters: {}".format(
+        stats["waiting"], stats["spooled"], stats["retried"], stats["resent"], stats["dead letters"]))
+
+    stats = parsers.segment_cache.stats()
+    lines.append("parse cache hits: {}, misses: {}, hit rate: {:.1%}, cached: {}, uncached: {}".format(
+        stats["hits"], stats["misses"], stats["hit rate"], stats["cached"], stats["uncached"]))
+    yield from bot.coro_send_message(event.conv, "<br />".join(lines))
+
+
+@command.register(admin=True)
+def deadletters(bot, event, *args):
+    """list messages that could not be sent
+    <b>deadletters replay [number ...]</b> sends them again, all if no number is given
+    <b>deadletters clear</b> forgets them"""
+    retry = bot._outbound.retry
+
+    if args and args[0] == "replay":
+        try:
+            indices = [ int(number) - 1 for number in args[1:] ] or None
+        except ValueError:
+            yield from bot.coro_send_message(event.conv, _("numbers required"))
+            return
+        message = _("{} messages replayed").format(retry.replay(indices))
+
+    elif args and args[0] == "clear":
+        message = _("{} dead letters cleared").format(retry.clear_dead_letters())
+
+    elif retry.dead_letters:
+        lines = [ "<b>dead letters</b>" ]
+        for number, entry in enumerate(retry.dead_letters, 1):
+            lines.append("{}. {} after {} retries, {}: <i>{}</i>".format(
+                number, entry["conv_id"], entry["attempt"], html.escape(entry["error"]),
+                html.escape(entry["text"])))
+        message = "<br />".join(lines)
+
+    else:
+        message = _("no dead letters")
+
+    yield from bot.coro_send_message(event.conv, message)
+
+
+@command.register(admin=True)
+def permissionstats(bot, event, *args):
+    """show how often cached command permissions were used and how long computing them took"""
+    stats = command.permission_stats()
+    lines = [ "<b>command permissions</b>",
+              "hits: {}, misses: {}, hit rate: {:.1%}, cached: {}".format(
+                  stats["hits"], stats["misses"], stats["hit rate"], stats["cached"]),
+              "computation last: {:.6f}s, average: {:.6f}s, max: {:.6f}s".format(
+                  stats["time.last"], stats["time.average"], stats["time.max"]) ]
+    yield from bot.coro_send_message(event.conv, "<br />".join(lines))
+
+
 @command.register_unknown
 def unknown_command(bot, event, *args):
     """handle unknown commands"""
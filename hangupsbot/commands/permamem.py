@@ -1,5 +1,7 @@
-import logging
+import asyncio, logging, marshal
 
+import config
+import memorytools
 import plugins
 
 
@@ -7,7 +9,7 @@ logger = logging.getLogger(__name__)
 
 
 def _initialise(bot):
-    plugins.register_admin_command(["dumpconv", "dumpunknownusers", "resetunknownusers", "refreshusermemory", "removeconvrecord", "makeallusersindefinite"])
+    plugins.register_admin_command(["dumpconv", "dumpunknownusers", "resetunknownusers", "refreshusermemory", "removeconvrecord", "makeallusersindefinite", "storagestats", "memorystats", "prunememory"])
 
 
 def dumpconv(bot, event, *args):
@@ -95,3 +97,68 @@ def makeallusersindefinite(bot, event, *args):
     logger.info("makeallusersindefinite finished")
 
     yield from bot.coro_send_message(event.conv, "<b>please see log/console</b>")
+
+
+def storagestats(bot, event, *args):
+    """show statistics of the background memory/config writer and the config view cache"""
+    stats = config.writer.stats()
+    lines = [ "<b>storage writer</b>",
+              "writes: {}, errors: {}, queued: {}".format(stats["writes"], stats["errors"], stats["queue"]),
+              "latency last: {:.4f}s, average: {:.4f}s, max: {:.4f}s".format(
+                  stats["latency.last"], stats["latency.average"], stats["latency.max"]) ]
+
+    stats = bot.config.view_stats()
+    lines.extend([ "<b>config views</b>",
+                   "hits: {}, misses: {}, hit rate: {:.1%}, cached: {}".format(
+                       stats["hits"], stats["misses"], stats["hit rate"], stats["views"]) ])
+
+    yield from bot.coro_send_message(event.conv, "<br />".join(lines))
+
+
+def memorystats(bot, event, *args):
+    """show the largest memory subtrees
+    /bot memorystats [depth]"""
+    depth = int(args[0]) if args and args[0].isdigit() else 1
+
+    # size the subtrees on a copy in another thread, json encoding the memory takes a while
+    data = marshal.loads(config.freeze(bot.memory.config))
+    loop = asyncio.get_event_loop()
+    sizes = yield from loop.run_in_executor(None, lambda: memorytools.subtree_sizes(data, depth=depth, limit=20))
+
+    lines = [ "<b>memory subtrees</b>" ]
+    for path, size, children in sizes:
+        lines.append("{} ({} entries) <b>{}</b>".format(
+            memorytools.format_size(size), children, ".".join(str(key) for key in path)))
+    yield from bot.coro_send_message(event.conv, "<br />".join(lines))
+
+
+def prunememory(bot, event, *args):
+    """remove stale users, expired invitations/dnd entries and orphaned tldrs from memory
+    /bot prunememory [days] [commit]
+    lists what would be removed, unless "commit" is supplied, which exports a json backup of
+    the memory first. users are stale if they are not in any conversation and did not send a
+    message for [days] (default: 180)"""
+    days = int(args[0]) if args and args[0].isdigit() else 180
+    dry_run = "commit" not in args
+
+    keep = set(bot.get_config_option("admins") or [])
+    paths = memorytools.stale_paths(bot.memory.config, days, keep=keep)
+
+    if not dry_run and paths:
+        # back up a copy in another thread, nothing is removed if that fails
+        data = marshal.loads(config.freeze(bot.memory.config))
+        loop = asyncio.get_event_loop()
+        filename = yield from loop.run_in_executor(None, memorytools.backup, bot.memory, data)
+        logger.info("memory saved to {} before pruning".format(filename))
+
+    removed = memorytools.prune(bot.memory, paths, dry_run=dry_run, make_backup=False)
+
+    reasons = {}
+    for path, reason in paths:
+        reasons[reason] = reasons.get(reason, 0) + 1
+
+    lines = [ "<b>{}</b>".format("would remove {} entries".format(removed) if dry_run else "removed {} entries".format(removed)) ]
+    lines.extend("{}: {}".format(reason, count) for reason, count in sorted(reasons.items()))
+    if dry_run and removed:
+        lines.append("<em>see log/console for details, add commit to remove</em>")
+    yield from bot.coro_send_message(event.conv, "<br />".join(lines))
@@ -1,40 +1,432 @@
-import collections, datetime, functools, json, glob, logging, os, shutil, sys, time
+import asyncio, binascii, collections, datetime, functools, hashlib, json, glob, logging, marshal, os, shutil, sqlite3, struct, sys, time, zlib
 
-from threading import Timer
+from threading import Condition, Lock, Thread
 
 
 logger = logging.getLogger(__name__)
 
 
+def atomic_write(filename, content):
+    """write bytes to a temporary file, fsync it, then atomically replace filename"""
+    temporary = filename + ".tmp"
+    with open(temporary, 'wb') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, filename)
+
+
+def atomic_write_json(filename, data):
+    """write data as json with atomic_write(), returns the sha256 of the written file"""
+    content = json.dumps(data, indent=2, sort_keys=True).encode("utf-8")
+    atomic_write(filename, content)
+    return hashlib.sha256(content).hexdigest()
+
+
+def freeze(value):
+    """marshal value, e.g. for a fast deep copy with marshal.loads(). values marshal cannot
+    handle (OrderedDict, subclasses of builtin types...) are stored like json would store them
+    """
+    try:
+        return marshal.dumps(value)
+    except ValueError:
+        return marshal.dumps(json.loads(json.dumps(value)))
+
+
+class StorageWriter:
+    """single background thread that writes storage snapshots to disk
+
+    the thread owning the data (usually the event loop) takes a snapshot on save() and
+    submits it here, so serialisation and disk access never block the event loop and never
+    race with mutations of the live data. each snapshot is a dict of write units (a file, a
+    row, the journal...), pending units of the same storage are coalesced with the newest
+    snapshot winning
+    """
+
+    def __init__(self):
+        self._condition = Condition()
+        self._pending = collections.OrderedDict()
+        self._busy = None
+        self._thread = None
+
+        self.writes = 0
+        self.errors = 0
+        self.latency_last = 0
+        self.latency_max = 0
+        self.latency_total = 0
+
+    def submit(self, storage, jobs):
+        with self._condition:
+            if id(storage) in self._pending:
+                pending = self._pending[id(storage)][1]
+                for unit, job in jobs.items():
+                    # move to the end, so the newer job is also applied last
+                    pending.pop(unit, None)
+                    pending[unit] = job
+            else:
+                self._pending[id(storage)] = (storage, collections.OrderedDict(jobs))
+
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name="storage-writer")
+                self._thread.daemon = True
+                self._thread.start()
+
+            self._condition.notify_all()
+
+    def wait(self, storage=None, timeout=None):
+        """block until everything pending (for storage, if supplied) is written"""
+        def _done():
+            if storage is None:
+                return not self._pending and self._busy is None
+            return id(storage) not in self._pending and self._busy is not storage
+
+        with self._condition:
+            return self._condition.wait_for(_done, timeout)
+
+    def queue_depth(self):
+        with self._condition:
+            return sum(len(jobs) for storage, jobs in self._pending.values())
+
+    def stats(self):
+        return { "writes": self.writes,
+                 "errors": self.errors,
+                 "queue": self.queue_depth(),
+                 "latency.last": self.latency_last,
+                 "latency.max": self.latency_max,
+                 "latency.average": self.latency_total / self.writes if self.writes else 0 }
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                storage, jobs = self._pending.popitem(last=False)[1]
+                self._busy = storage
+
+            start_time = time.time()
+            try:
+                storage._write_snapshot(jobs)
+            except Exception:
+                logger.exception("{} write failed, retrying on next save".format(storage.filename))
+                self.errors = self.errors + 1
+                storage.force_taint()
+            interval = time.time() - start_time
+
+            with self._condition:
+                self._busy = None
+                self.writes = self.writes + 1
+                self.latency_last = interval
+                self.latency_max = max(self.latency_max, interval)
+                self.latency_total = self.latency_total + interval
+                self._condition.notify_all()
+
+            logger.info("{} write {}".format(storage.filename, interval))
+
+
+writer = StorageWriter()
+
+
+_missing = object()
+
+_placeholder = object()
+
+
+def _resolve(node, keys):
+    """walk keys from node with direct lookups, returns _missing instead of raising on a miss"""
+    for key in keys:
+        if isinstance(node, dict):
+            node = node.get(key, _missing)
+            if node is _missing:
+                return node
+        elif isinstance(node, list):
+            try:
+                node = node[int(key)]
+            except (IndexError, ValueError):
+                return _missing
+        else:
+            return _missing
+    return node
+
+
+def _json_key(key):
+    """key as json writes it, object keys are always strings"""
+    if isinstance(key, str):
+        return key
+    if key is None or isinstance(key, (int, float)):
+        return json.dumps(key)
+    raise TypeError("keys must be str, int, float, bool or None, not {}".format(type(key).__name__))
+
+
+class ConfigPath:
+    """cached read accessor for a path of a Config, see Config.path()
+
+    "*" in the path is a placeholder for an id supplied on every lookup:
+
+        nickname = bot.memory.path("user_data", "*", "nickname")
+        nickname.get(chat_id)
+        nickname.exists(chat_id)
+        nickname.get_many(chat_ids) # { chat_id: nickname or None }
+
+    lookups walk the cached key tuple with dict.get(), so a miss raises no exceptions.
+    get_many() walks the part before the placeholder only once
+    """
+
+    placeholder = "*"
+
+    def __init__(self, config, keys):
+        self.config = config
+        self.keys = tuple(keys)
+        self.placeholders = self.keys.count(self.placeholder)
+
+        # placeholders are marked by identity, so a lookup does not compare every key
+        self._steps = tuple(_placeholder if key == self.placeholder else key for key in self.keys)
+        if self.placeholders == 1:
+            split = self.keys.index(self.placeholder)
+            self._head = self._steps[:split]
+            self._tail = self._steps[split:]
+
+    def _walk(self, node, steps, ids):
+        """value at steps below node with the placeholders replaced by ids in order, _missing
+        if there is none
+        """
+        index = 0
+        for key in steps:
+            if key is _placeholder:
+                key = ids[index]
+                index += 1
+            if type(node) is dict:
+                node = node.get(key, _missing)
+            else:
+                # lists and anything else than a plain dict
+                node = _resolve(node, (key,))
+            if node is _missing:
+                return node
+        return node
+
+    def get(self, *ids, default=None):
+        """return the value at the path, default if there is none"""
+        value = self._walk(self.config.config, self._steps, ids)
+        return default if value is _missing else value
+
+    def get_many(self, ids, default=None):
+        """return { id: value } for all ids, ids are tuples if the path has several placeholders"""
+        if self.placeholders != 1:
+            return { id: self.get(*id, default=default) for id in ids }
+
+        base = self._walk(self.config.config, self._head, ())
+        if base is _missing:
+            return dict.fromkeys(ids, default)
+
+        values = {}
+        for id in ids:
+            value = self._walk(base, self._tail, (id,))
+            values[id] = default if value is _missing else value
+        return values
+
+    def exists(self, *ids):
+        """same as Config.exists(): a None value does not exist"""
+        return self.get(*ids) is not None
+
+    def __repr__(self):
+        return "<ConfigPath {}>".format(".".join(str(key) for key in self.keys))
+
+
+class ConfigView:
+    """read-only resolved options of one conversation: the global options overridden by
+    the ones in conversations.<conv_id>
+
+    options are attributes (view.commands_enabled), options which are not valid identifiers
+    are available with view["mentions.enabled"] or view.get("mentions.enabled"). missing
+    options are None, just like Config.get_suboption(). values are shared with the config
+    and must not be modified
+    """
+
+    __slots__ = ("conv_id", "generation", "_values")
+
+    def __init__(self, conv_id, values, generation):
+        object.__setattr__(self, "conv_id", conv_id)
+        object.__setattr__(self, "generation", generation)
+        object.__setattr__(self, "_values", values)
+
+    def get(self, option, default=None):
+        return self._values.get(option, default)
+
+    def __getattr__(self, option):
+        if option.startswith("__"):
+            raise AttributeError(option)
+        return self._values.get(option)
+
+    def __getitem__(self, option):
+        return self._values.get(option)
+
+    def __contains__(self, option):
+        return option in self._values
+
+    def __setattr__(self, name, value):
+        raise AttributeError("{} is read-only".format(type(self).__name__))
+
+    def __dir__(self):
+        return list(self.__slots__) + [ option for option in self._values if option.isidentifier() ]
+
+    def __repr__(self):
+        return "<ConfigView {} generation {}>".format(self.conv_id, self.generation)
+
+
 class Config(collections.MutableMapping):
-    """Configuration JSON storage class"""
-    def __init__(self, filename, default=None, failsafe_backups=0, save_delay=0):
+    """Configuration JSON storage class
+
+    changes made through set_by_path()/pop_by_path()/item assignment are tracked per
+        top-level key and per child of a top-level dict (e.g. ["user_data", chat_id]),
+        storage engines use this to only write what changed. a dict or list returned by
+        get_by_path() may be changed in place, its path is written with the next save.
+        values returned by item access (memory["key"]) must not be changed in place, use
+        set_by_path() or force_taint() instead
+
+    journal = True (or a size limit in bytes) appends the current value of every changed
+        path to <filename>.journal on save() instead of rewriting the whole file, so changes
+        made in place are journalled as well. the journal is folded into the main file
+        (compaction) once it grows past the limit, when the data is tainted with
+        force_taint()/loads() and on flush()
+
+    save() snapshots the data on the calling thread and hands it to the StorageWriter,
+        which writes it to disk in the background. save() and the save_delay timer should
+        therefore run on the event loop thread that mutates the data. the snapshot is a
+        marshalled copy of every top-level key and of every child of a top-level dict, which
+        is kept between saves: only changed paths are marshalled again
+
+    get_view() returns a cached ConfigView per conversation. the cache is dropped whenever
+        the data is changed through the methods above, loads(), force_taint() or (re)load()
+
+    binary_snapshot = True writes saves to <filename>.snapshot, a marshal dump with a
+        versioned header and a sha256 checksum, which loads much faster than json. the json
+        file stays the human-editable export: it is written on flush() and import_json(),
+        and a json file edited after the last snapshot is loaded instead of the snapshot
+    """
+
+    journal_limit_default = 4 * 1024 * 1024
+
+    snapshot_magic = b"HBOTSNAP"
+    snapshot_version = 1
+    # magic, snapshot version, marshal version, sha256 of the payload, sha256 of the json export
+    _snapshot_header = struct.Struct(">8sHH32s32s")
+
+    def __init__(self, filename, default=None, failsafe_backups=0, save_delay=0, journal=False,
+                 binary_snapshot=False):
         self.filename = filename
         self.default = None
         self.config = {}
         self.changed = False
         self.failsafe_backups = failsafe_backups
         self.save_delay = save_delay
-        self.load()
 
-        self._timer_save = False
+        if journal is True:
+            journal = self.journal_limit_default
+        self.journal = int(journal or 0)
+        self._journal_file = None
+        self._journal_lock = Lock()
+        self._journal_size = 0
+        self._journal_segment = 0
+        self._compaction_required = False
+        self._loaded_digest = None
+
+        self._dirty = {}
+        self._dirty_all = False
+
+        self._frozen = None # { key: marshalled value, or buckets of { child: marshalled value } for a dict }
+        self._frozen_dirty = {}
+
+        self._generation = 0
+        self._views = {}
+        self._views_generation = 0
+        self.view_hits = 0
+        self.view_misses = 0
+
+        self._paths = {}
+
+        self._loop = asyncio.get_event_loop()
+        self._timer_save = None
+
+        self._checksum = None
+        self._checksum_stat = None
+
+        self.binary_snapshot = binary_snapshot
+        self._export_pending = False
+
+        self.load()
 
     def _make_failsafe_backup(self):
-        try:
-            with open(self.filename) as f:
-                json.load(f)
-        except IOError:
+        """keep the current file as a backup before it is replaced
+        the file is hardlinked into the backup slot - the following atomic replace gives the
+        live file a new inode, so the backup keeps the previous content without a copy. the
+        checksum of the backup is stored next to it, older backups are only rotated out if it
+        matches the content known from the last read/write. the file is only hashed if its
+        size, mtime or inode differ from the ones recorded with that checksum
+        """
+        if self._checksum is None or not os.path.isfile(self.filename):
+            # never verified this file, do not rotate out a good backup for it
             return False
-        except ValueError:
-            logger.warning("{} is corrupted, aborting backup".format(self.filename))
+
+        backup_file = self.filename + "." + datetime.datetime.now().strftime("%Y%m%d%H%M%S") + ".bak"
+        self._remove_backup(backup_file)
+        try:
+            os.link(self.filename, backup_file)
+        except OSError:
+            # filesystem without hardlinks
+            shutil.copy2(self.filename, backup_file)
+
+        if self._file_stat(backup_file) == self._checksum_stat:
+            checksum = self._checksum
+        else:
+            checksum = self._file_checksum(backup_file)
+        if checksum != self._checksum:
+            logger.warning("{} changed since it was last read, not kept as a backup".format(self.filename))
+            self._remove_backup(backup_file)
             return False
 
-        existing = sorted(glob.glob(self.filename + ".*.bak"))
+        with open(backup_file + ".sha256", 'w') as f:
+            f.write("{}  {}\n".format(checksum, os.path.basename(backup_file)))
+
+        existing = [ filename for filename in sorted(glob.glob(self.filename + ".*.bak"))
+                     if filename != backup_file ]
         while len(existing) > (self.failsafe_backups - 1):
-            os.remove(existing.pop(0))
+            self._remove_backup(existing.pop(0))
 
-        backup_file = self.filename + "." + datetime.datetime.now().strftime("%Y%m%d%H%M%S") + ".bak"
-        shutil.copy2(self.filename, backup_file)
+        return True
+
+    def _file_stat(self, filename, f=None):
+        """(size, mtime, inode) of the file, None if it cannot be read"""
+        try:
+            stat = os.fstat(f.fileno()) if f else os.stat(filename)
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+    def _file_checksum(self, filename):
+        sha256 = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for chunk in iter(functools.partial(f.read, 1 << 20), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def _remove_backup(self, backup_file):
+        for filename in (backup_file, backup_file + ".sha256"):
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+    def _verify_backup(self, backup_file):
+        """check a backup against its checksum, backups without one are parsed instead"""
+        try:
+            with open(backup_file + ".sha256") as f:
+                expected = f.read().split()[0]
+        except (IOError, IndexError):
+            with open(backup_file) as f:
+                json.load(f)
+            return True
+
+        if self._file_checksum(backup_file) != expected:
+            raise ValueError("checksum mismatch")
 
         return True
 
@@ -43,9 +435,7 @@ class Config(collections.MutableMapping):
         while len(existing) > 0:
             try:
                 recovery_filename = existing.pop()
-                with open(recovery_filename) as f:
-                    # test the file is valid json
-                    json.load(f)
+                self._verify_backup(recovery_filename)
 
                 shutil.copy2(recovery_filename, self.filename)
                 self.load(recovery=True)
@@ -54,78 +444,561 @@ class Config(collections.MutableMapping):
             except IOError:
                 pass
             except ValueError:
-                logger.error("corrupted recovery: {}".format(self.filename))
+                logger.error("corrupted recovery: {}".format(recovery_filename))
         return False
 
     def load(self, recovery=False):
         """Load config from file"""
+        writer.wait(self)
+
+        self._checksum = None
+        self._checksum_stat = None
+        self._loaded_digest = None
+
+        if not (self.binary_snapshot and not recovery and self._load_binary_snapshot()):
+            try:
+                with open(self.filename, 'rb') as f:
+                    content = f.read()
+                    stat = self._file_stat(self.filename, f)
+                self.config = json.loads(content.decode("utf-8"))
+                self._checksum = hashlib.sha256(content).hexdigest()
+                self._checksum_stat = stat
+                self._loaded_digest = self._checksum
+                logger.info("{} read".format(self.filename))
+
+            except IOError:
+                self.config = {}
+
+            except ValueError:
+                if not recovery and self.failsafe_backups > 0 and self._recover_from_failsafe():
+                    return
+
+                raise
+
+        self._reset_dirty()
+
+        if self.journal:
+            self._journal_replay()
+
+    def is_new(self):
+        """True if nothing has been stored yet"""
+        return not os.path.isfile(self.filename)
+
+    def _snapshot_filename(self, previous=False):
+        return self.filename + (".snapshot.previous" if previous else ".snapshot")
+
+    def _load_binary_snapshot(self):
+        """load the newest valid binary snapshot that is not older than the json file"""
+        try:
+            json_mtime = os.stat(self.filename).st_mtime
+        except OSError:
+            json_mtime = None
+
+        for filename in (self._snapshot_filename(), self._snapshot_filename(previous=True)):
+            try:
+                if json_mtime is not None and os.stat(filename).st_mtime < json_mtime:
+                    logger.info("{} is older than {}, ignored".format(filename, self.filename))
+                    continue
+
+                with open(filename, 'rb') as f:
+                    content = f.read()
+
+                magic, version, marshal_version, checksum, json_checksum = self._snapshot_header.unpack_from(content)
+                if magic != self.snapshot_magic:
+                    raise ValueError("not a snapshot")
+                if (version, marshal_version) != (self.snapshot_version, marshal.version):
+                    # e.g. written by another python version
+                    logger.info("{} has format {}/{}, ignored".format(filename, version, marshal_version))
+                    continue
+
+                payload = content[self._snapshot_header.size:]
+                if hashlib.sha256(payload).digest() != checksum:
+                    raise ValueError("checksum mismatch")
+
+                self.config = marshal.loads(payload)
+                self._loaded_digest = binascii.hexlify(checksum).decode("ascii")
+                if any(json_checksum):
+                    self._checksum = binascii.hexlify(json_checksum).decode("ascii")
+                logger.info("{} read".format(filename))
+                return True
+
+            except IOError:
+                pass
+            except (ValueError, EOFError, TypeError, struct.error) as e:
+                logger.warning("{} corrupted: {}".format(filename, e))
+
+        return False
+
+    def _write_binary_snapshot(self, data, segments=()):
+        """write data as marshalled snapshot, the previous one is kept as a fallback"""
+        filename = self._snapshot_filename()
+        previous = self._snapshot_filename(previous=True)
+
+        data = marshal.dumps(data)
+        checksum = hashlib.sha256(data).digest()
+        header = self._snapshot_header.pack(
+            self.snapshot_magic, self.snapshot_version, marshal.version, checksum,
+            binascii.unhexlify(self._checksum) if self._checksum else bytes(32))
+        self._journal_mark_compacted(segments, binascii.hexlify(checksum).decode("ascii"))
+
+        if os.path.isfile(filename):
+            try:
+                os.remove(previous)
+            except OSError:
+                pass
+            try:
+                os.link(filename, previous)
+            except OSError:
+                shutil.copy2(filename, previous)
+
+        atomic_write(filename, header + data)
+
+    def _write_json(self, data, segments=()):
+        if self.failsafe_backups:
+            self._make_failsafe_backup()
+
+        content = json.dumps(data, indent=2, sort_keys=True).encode("utf-8")
+        checksum = hashlib.sha256(content).hexdigest()
+        self._journal_mark_compacted(segments, checksum)
+        atomic_write(self.filename, content)
+        self._checksum = checksum
+        self._checksum_stat = self._file_stat(self.filename)
+
+    def _journal_filename(self, segment=None):
+        if segment is None:
+            return self.filename + ".journal"
+        return "{}.journal.{}".format(self.filename, segment)
+
+    def _journal_segments(self):
+        """return the (segment number, filename) of rotated journals, oldest first"""
+        segments = []
+        for filename in glob.glob(self._journal_filename("*")):
+            try:
+                segments.append((int(filename.rsplit(".", 1)[1]), filename))
+            except ValueError:
+                pass
+        return sorted(segments)
+
+    def _journal_dirty(self):
+        """journal the current value of every changed path, the journal is only synced to disk
+        by the StorageWriter. values are journalled whole, so changes made in place are covered.
+        returns False if the changes cannot be journalled and need a compaction instead
+        """
+        if self._dirty_all:
+            return False
+
+        dirty = self._take_dirty()[0]
+        # journalled, but not marshalled yet
+        self._frozen_dirty.update(dirty)
+
+        entries = {}
+        for path, used in dirty.items():
+            if len(path) == 2 and ((path[0],) in dirty or not isinstance(self.config.get(used[0]), dict)):
+                path, used = path[:1], used[:1]
+            if path in entries:
+                continue
+            value = _resolve(self.config, used)
+            entries[path] = ["pop", list(used)] if value is _missing else ["set", list(used), value]
+
         try:
-            with open(self.filename) as f:
-                self.config = json.load(f)
-            logger.info("{} read".format(self.filename))
+            lines = "".join(json.dumps(entry, sort_keys=True) + "\n" for entry in entries.values())
+        except (TypeError, ValueError):
+            logger.exception("{} cannot journal {}".format(self.filename, list(entries)))
+            return False
+
+        with self._journal_lock:
+            if self._journal_file is None:
+                self._journal_file = open(self._journal_filename(), "a")
+            self._journal_file.write(lines)
+            self._journal_size += len(lines)
+
+        return True
+
+    def _journal_apply(self, entry):
+        """apply a journalled ["set", path, value] or ["pop", path], path is [key] or
+        [key, child]. entries hold whole values, so applying one again changes nothing
+        """
+        operation, keys_list = entry[0], entry[1]
+        if operation == "compacted":
+            return
+
+        parent = self.config
+        if len(keys_list) == 2:
+            parent = self.config[keys_list[0]]
+            if not isinstance(parent, dict):
+                raise TypeError("{} is not a dict".format(keys_list[0]))
+        elif len(keys_list) != 1:
+            raise ValueError("journalled path {} is too long".format(keys_list))
+
+        if operation == "set":
+            parent[keys_list[-1]] = entry[2]
+        elif operation == "pop":
+            parent.pop(keys_list[-1], None)
+        else:
+            raise ValueError("unknown journal operation {}".format(operation))
+
+    def _journal_mark_compacted(self, segments, digest):
+        """record in the rotated segments the digest of the snapshot that covers them, before
+        that snapshot replaces the file. segments left behind by a compaction that completed
+        the snapshot are recognised on load and not replayed over the newer data
+        """
+        line = json.dumps(["compacted", digest]) + "\n"
+        for filename in segments:
+            try:
+                with open(filename, "a") as f:
+                    f.write(line)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError as e:
+                logger.warning("{} not marked as compacted: {}".format(filename, e))
+
+    def _journal_replay(self):
+        """re-apply journalled values on top of the loaded snapshot
+        an interrupted compaction leaves rotated journal segments behind, which are older than
+        the live journal and are replayed first - unless they are marked as compacted into the
+        loaded snapshot. a partially written trailing entry is truncated so that further
+        appends start on a clean line
+        """
+        with self._journal_lock:
+            if self._journal_file is not None:
+                self._journal_file.close()
+                self._journal_file = None
+
+            self._journal_size = 0
+            replayed = 0
+
+            segments = self._journal_segments()
+            if segments:
+                self._journal_segment = segments[-1][0]
+
+            for filename in [ filename for segment, filename in segments ] + [ self._journal_filename() ]:
+                try:
+                    with open(filename, "rb") as f:
+                        data = f.read()
+                except IOError:
+                    continue
 
-        except IOError:
-            self.config = {}
+                entries = []
+                offset = 0
+                for line in data.splitlines(keepends=True):
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        entries.append(json.loads(line.decode()))
+                    except ValueError:
+                        break
+                    offset += len(line)
 
-        except ValueError:
-            if not recovery and self.failsafe_backups > 0 and self._recover_from_failsafe():
+                if offset < len(data):
+                    logger.warning("{} truncated at {} of {} bytes".format(filename, offset, len(data)))
+                    with open(filename, "r+b") as f:
+                        f.truncate(offset)
+
+                if filename != self._journal_filename() and ["compacted", self._loaded_digest] in entries:
+                    logger.info("{} is already compacted into the loaded data".format(filename))
+                    try:
+                        os.remove(filename)
+                    except OSError:
+                        pass
+                    continue
+
+                for entry in entries:
+                    try:
+                        self._journal_apply(entry)
+                        replayed = replayed + 1
+                    except (KeyError, IndexError, TypeError, ValueError) as e:
+                        logger.warning("{} skipped journal entry {}: {}".format(filename, entry, e))
+
+                if filename == self._journal_filename():
+                    self._journal_size = offset
+                else:
+                    # snapshot may be older than these entries, fold them in on next save
+                    self._compaction_required = True
+
+            if replayed:
+                logger.info("{} replayed {} journal entries".format(self.filename, replayed))
+                self.changed = self._compaction_required
+
+    def _journal_sync(self):
+        with self._journal_lock:
+            if self._journal_file is None:
                 return
+            self._journal_file.flush()
+            fileno = self._journal_file.fileno()
+        try:
+            os.fsync(fileno)
+        except OSError:
+            # journal was rotated in the meantime, the compaction covers it
+            pass
 
-            raise
+    def _journal_rotate(self):
+        """move the live journal aside when a compaction snapshot is taken
+        entries appended while the snapshot is being written go into a fresh journal
+        returns all rotated segments, these are covered by the snapshot
+        """
+        with self._journal_lock:
+            if self._journal_file is not None:
+                self._journal_file.close()
+                self._journal_file = None
 
-        self.changed = False
+            live = self._journal_filename()
+            if os.path.isfile(live):
+                self._journal_segment = self._journal_segment + 1
+                os.replace(live, self._journal_filename(self._journal_segment))
+
+            self._journal_size = 0
+            self._compaction_required = False
+
+        return [ filename for segment, filename in self._journal_segments()
+                 if segment <= self._journal_segment ]
+
+    def _journal_compaction_due(self):
+        return self._compaction_required or self._journal_size >= self.journal
 
     def force_taint(self):
         self.changed = True
+        self._dirty_all = True
+        self._compaction_required = True
+        self._generation += 1
 
     def loads(self, json_str):
         """Load config from JSON string"""
         self.config = json.loads(json_str)
-        self.changed = True
+        self.force_taint()
+
+    def _schedule_save(self):
+        """(re)start the save delay on the event loop, coalescing saves requested meanwhile"""
+        def _restart():
+            if self._timer_save:
+                self._timer_save.cancel()
+            self._timer_save = self._loop.call_later(self.save_delay, self.save, False)
+
+        self._loop.call_soon_threadsafe(_restart)
 
     def save(self, delay=True):
         if self.save_delay:
             if delay:
-                if self._timer_save and self._timer_save.is_alive():
-                    self._timer_save.cancel()
-                self._timer_save = Timer(self.save_delay, self.save, [], {"delay": False})
-                self._timer_save.start()
+                self._schedule_save()
                 return False
 
         """Save config to file (only if config has changed)"""
         if self.changed:
-            start_time = time.time()
+            if self.journal and not self._journal_compaction_due() and self._journal_dirty():
+                jobs = { "journal": None }
+            else:
+                jobs = self._snapshot()
+            self.changed = False
 
-            if self.failsafe_backups:
-                self._make_failsafe_backup()
+            writer.submit(self, jobs)
 
-            with open(self.filename, 'w') as f:
-                json.dump(self.config, f, indent=2, sort_keys=True)
-                self.changed = False
-            interval = time.time() - start_time
+        return self.changed
 
-            logger.info("{} write {}".format(self.filename, interval))
+    def _snapshot(self):
+        """capture everything that needs to be written, on the thread that owns the data
+        the data is copied by the marshalled values of _freeze(), the actual serialisation
+        happens in the writer
+        """
+        frozen = self._freeze(*self._take_dirty())
+        segments = self._journal_rotate() if self.journal else []
 
-        return self.changed
+        jobs = collections.OrderedDict()
+        if self.binary_snapshot and (self._export_pending or not os.path.isfile(self.filename)):
+            jobs["export"] = frozen
+        jobs["file"] = (frozen, segments)
+        self._export_pending = False
+
+        return jobs
+
+    _frozen_buckets = 64
+
+    def _freeze(self, dirty, dirty_all):
+        """bring the marshalled copy of the data up to date and return a snapshot of it
+        only changed paths are marshalled again. the children of a dict are spread over
+        buckets, a changed child gets its key a new list of buckets and its bucket a new dict
+        instead of changing them in place (copy on write), so snapshots handed to the writer
+        stay as they were and a change only copies a bucket
+        """
+        dirty.update(self._frozen_dirty)
+        self._frozen_dirty = {}
+
+        if dirty_all or self._frozen is None:
+            self._frozen = { key: self._freeze_value(value) for key, value in self.config.items() }
+            return dict(self._frozen)
+
+        copied = set()
+        for used in dirty.values():
+            key = used[0]
+            value = self.config.get(key, _missing)
+            if value is _missing:
+                self._frozen.pop(key, None)
+
+            elif len(used) == 1 or not isinstance(value, dict) or not isinstance(self._frozen.get(key), list):
+                self._frozen[key] = self._freeze_value(value)
+                copied.add(key)
+
+            else:
+                child = used[1]
+                if key not in copied:
+                    self._frozen[key] = list(self._frozen[key])
+                    copied.add(key)
+                buckets = self._frozen[key]
+                index = hash(child) % self._frozen_buckets
+                if (key, index) not in copied:
+                    buckets[index] = dict(buckets[index])
+                    copied.add((key, index))
+                item = value.get(child, _missing)
+                if item is _missing:
+                    buckets[index].pop(child, None)
+                else:
+                    buckets[index][child] = freeze(item)
+
+        return dict(self._frozen)
+
+    def _freeze_value(self, value):
+        if isinstance(value, dict):
+            buckets = [ {} for index in range(self._frozen_buckets) ]
+            for child, item in value.items():
+                buckets[hash(child) % self._frozen_buckets][child] = freeze(item)
+            return buckets
+        return freeze(value)
+
+    def _thaw(self, frozen):
+        """the data of a snapshot taken by _freeze(), runs on the StorageWriter thread"""
+        data = {}
+        for key, value in frozen.items():
+            if isinstance(value, list):
+                data[key] = { child: marshal.loads(item) for bucket in value for child, item in bucket.items() }
+            else:
+                data[key] = marshal.loads(value)
+        return data
+
+    def _write_snapshot(self, jobs):
+        """write a snapshot, runs on the StorageWriter thread"""
+        thawed = (None, None)
+        for unit, job in jobs.items():
+            if unit == "journal":
+                self._journal_sync()
+                continue
+
+            frozen = job if unit == "export" else job[0]
+            if thawed[0] is not frozen:
+                # export and file usually share the snapshot
+                thawed = (frozen, self._thaw(frozen))
+            data = thawed[1]
+
+            if unit == "export":
+                self._write_json(data)
+
+            elif unit == "file":
+                segments = job[1]
+
+                if self.binary_snapshot:
+                    self._write_binary_snapshot(data, segments)
+                else:
+                    self._write_json(data, segments)
+
+                for filename in segments:
+                    try:
+                        os.remove(filename)
+                    except OSError:
+                        pass
+
+    def import_json(self, filename):
+        """replace the stored data with the contents of a json file, e.g. an old memory.json"""
+        with open(filename) as f:
+            self.config = json.load(f)
+        self.force_taint()
+        self._export_pending = True
+        self.save(delay=False)
+        writer.wait(self)
+        logger.info("{} imported into {}".format(filename, self.filename))
+
+    def export_json(self, filename):
+        """write the current data to a json file"""
+        atomic_write_json(filename, self.config)
+        logger.info("{} exported to {}".format(self.filename, filename))
 
     def flush(self):
-        if self._timer_save and self._timer_save.is_alive():
+        if self._timer_save:
             logger.info("flushing {}".format(self.filename))
             self._timer_save.cancel()
+            self._timer_save = None
+        if self.journal and self._journal_size:
+            # fold the journal into the main file on shutdown for a faster next start
+            self.force_taint()
+        if self.binary_snapshot:
+            # keep the json export up to date
+            self.force_taint()
+            self._export_pending = True
         self.save(delay=False)
+        writer.wait(self)
 
     def get_by_path(self, keys_list):
         """Get item from config by path (list of keys)"""
-        return functools.reduce(lambda d, k: d[int(k) if isinstance(d, list) else k], keys_list, self)
+        node = self._get_by_path(keys_list)
+        if keys_list and isinstance(node, (dict, list)):
+            # may be changed in place, written with the next save
+            self._track(keys_list)
+        return node
+
+    def _get_by_path(self, keys_list):
+        node = self
+        for key in keys_list:
+            node = node[int(key) if isinstance(node, list) else key]
+        return node
+
+    def path(self, *keys):
+        """return a (cached) ConfigPath accessor, e.g. path("user_data", "*", "nickname")"""
+        try:
+            return self._paths[keys]
+        except KeyError:
+            accessor = self._paths[keys] = ConfigPath(self, keys)
+            return accessor
+
+    def _get_parent(self, keys_list):
+        parent = self._get_by_path(keys_list[:-1])
+        if parent is self:
+            # bypass __setitem__/__delitem__, the change is tracked by the caller
+            parent = self.config
+        return parent
+
+    def _track(self, keys_list):
+        """track (key,) or (key, child) as { path as json writes it: path as used }, engines
+        look values up with the path as used and store them under the json path
+        """
+        path = tuple(keys_list[:2])
+        self._dirty[tuple(_json_key(key) for key in path)] = path
+
+    def _mark_dirty(self, keys_list):
+        self._track(keys_list)
+        self._generation += 1
+
+    def _reset_dirty(self):
+        """freshly loaded data has no pending changes"""
+        self.changed = False
+        self._dirty = {}
+        self._dirty_all = False
+        self._frozen = None
+        self._frozen_dirty = {}
+        self._generation += 1
+
+    def _take_dirty(self):
+        """return and reset the tracked changes as (dict of paths, everything changed)"""
+        dirty, self._dirty = self._dirty, {}
+        dirty_all, self._dirty_all = self._dirty_all, False
+        return dirty, dirty_all
 
     def set_by_path(self, keys_list, value):
         """Set item in config by path (list of keys)"""
-        self.get_by_path(keys_list[:-1])[keys_list[-1]] = value
+        parent = self._get_parent(keys_list)
+        self._mark_dirty(keys_list)
+        parent[keys_list[-1]] = value
         self.changed = True
 
     def pop_by_path(self, keys_list):
-        popped_value = self.get_by_path(keys_list[:-1]).pop(keys_list[-1])
+        popped_value = self._get_parent(keys_list).pop(keys_list[-1])
         self.changed = True
+        self._mark_dirty(keys_list)
         return popped_value
 
     def get_option(self, keyname):
@@ -142,16 +1015,48 @@ class Config(collections.MutableMapping):
             value = self.get_option(keyname)
         return value
 
-    def exists(self, keys_list):
-        _exists = True
+    def mark_saved(self, checksum=None):
+        """the data matches the file on disk, e.g. after applying changes made to the file"""
+        self.changed = False
+        self._take_dirty()
+        # the changes are in the file, but not in the marshalled copy
+        self._frozen = None
+        self._checksum = checksum
+        self._checksum_stat = None
+
+    def get_view(self, conv_id):
+        """return the ConfigView of a conversation, resolved once per change of the data"""
+        if self._views_generation != self._generation:
+            self._views = {}
+            self._views_generation = self._generation
+
+        try:
+            view = self._views[conv_id]
+        except KeyError:
+            self.view_misses += 1
+        else:
+            self.view_hits += 1
+            return view
 
+        values = dict(self.config)
         try:
-            if self.get_by_path(keys_list) is None:
-                _exists = False
+            values.update(self.config["conversations"][conv_id])
         except (KeyError, TypeError):
-            _exists = False
+            pass
 
-        return _exists
+        view = self._views[conv_id] = ConfigView(conv_id, values, self._generation)
+        return view
+
+    def view_stats(self):
+        lookups = self.view_hits + self.view_misses
+        return { "hits": self.view_hits,
+                 "misses": self.view_misses,
+                 "hit rate": self.view_hits / lookups if lookups else 0,
+                 "views": len(self._views) }
+
+    def exists(self, keys_list):
+        value = _resolve(self.config, keys_list)
+        return value is not _missing and value is not None
 
     def __getitem__(self, key):
         try:
@@ -160,15 +1065,343 @@ class Config(collections.MutableMapping):
             return self.default
 
     def __setitem__(self, key, value):
+        self._mark_dirty([key])
         self.config[key] = value
         self.changed = True
 
     def __delitem__(self, key):
         del self.config[key]
         self.changed = True
+        self._mark_dirty([key])
 
     def __iter__(self):
         return iter(self.config)
 
     def __len__(self):
         return len(self.config)
+
+
+class SQLiteConfig(Config):
+    """memory storage in a local sqlite database
+
+    top-level keys holding a dict (user_data, conv_data, convmem, ...) are stored as one row
+    per child key, so a path write only updates the affected row on save(). any other
+    top-level value is stored as a single row. the complete data is still held in memory
+    and read through the usual Config methods
+
+    keys of rows are stored as json writes them (1 becomes "1", True becomes "true"), so the
+    data reads back like it would from a json file
+    """
+
+    def __init__(self, filename, default=None, failsafe_backups=0, save_delay=0, journal=False,
+                 binary_snapshot=False):
+        self._connection = None
+        self._connection_lock = Lock()
+
+        if failsafe_backups or journal or binary_snapshot:
+            logger.info("{} failsafe backups, journal and snapshots are handled by sqlite".format(filename))
+
+        super().__init__(filename, default=default, save_delay=save_delay)
+
+    def _connect(self):
+        with self._connection_lock:
+            if self._connection is not None:
+                self._connection.close()
+
+            # rows are written on the StorageWriter thread
+            self._connection = sqlite3.connect(self.filename, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS memory_keys "
+                                     "(key TEXT PRIMARY KEY, value TEXT)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS memory_children "
+                                     "(key TEXT, child TEXT, value TEXT, PRIMARY KEY (key, child))")
+            self._connection.commit()
+
+    def load(self, recovery=False):
+        """Load memory from the database"""
+        writer.wait(self)
+        self._connect()
+
+        data = {}
+        with self._connection_lock:
+            for key, value in self._connection.execute("SELECT key, value FROM memory_keys"):
+                # NULL value marks a dict container, its items are in memory_children
+                data[key] = {} if value is None else json.loads(value)
+
+            for key, child, value in self._connection.execute("SELECT key, child, value FROM memory_children"):
+                if isinstance(data.get(key), dict):
+                    data[key][child] = json.loads(value)
+                else:
+                    logger.warning("{} orphaned row {}/{}".format(self.filename, key, child))
+
+        self.config = data
+        self._reset_dirty()
+
+        logger.info("{} read {} keys".format(self.filename, len(data)))
+
+    def is_new(self):
+        """True if the database holds no rows yet, the file itself is created on load"""
+        with self._connection_lock:
+            return self._connection.execute("SELECT 1 FROM memory_keys LIMIT 1").fetchone() is None
+
+    def _snapshot(self):
+        """capture the changed rows as ("all",), ("key", key) or ("child", key, child) units
+        with marshalled values, None marks a removed key/child
+        """
+        dirty, dirty_all = self._take_dirty()
+        jobs = collections.OrderedDict()
+
+        if dirty_all:
+            jobs[("all",)] = freeze(self.config)
+            return jobs
+
+        whole_keys = { path[0]: used[0] for path, used in dirty.items()
+                       if len(path) == 1 or not isinstance(self.config.get(used[0]), dict) }
+        for key, used_key in whole_keys.items():
+            value = self.config.get(used_key, _missing)
+            jobs[("key", key)] = None if value is _missing else freeze(value)
+
+        for path, used in dirty.items():
+            if len(path) == 2 and path[0] not in whole_keys:
+                item = self.config[used[0]].get(used[1], _missing)
+                jobs[("child",) + path] = None if item is _missing else freeze(item)
+
+        return jobs
+
+    def _insert_key(self, cursor, key, value):
+        key = _json_key(key)
+        if isinstance(value, dict):
+            cursor.execute("INSERT INTO memory_keys (key, value) VALUES (?, NULL)", (key,))
+            cursor.executemany("INSERT INTO memory_children (key, child, value) VALUES (?, ?, ?)",
+                               [ (key, _json_key(child), json.dumps(item, sort_keys=True))
+                                 for child, item in value.items() ])
+        else:
+            cursor.execute("INSERT INTO memory_keys (key, value) VALUES (?, ?)",
+                           (key, json.dumps(value, sort_keys=True)))
+
+    def _write_snapshot(self, jobs):
+        """write changed rows in a single transaction, runs on the StorageWriter thread"""
+        with self._connection_lock, self._connection:
+            cursor = self._connection.cursor()
+
+            for unit, data in jobs.items():
+                if unit[0] == "all":
+                    cursor.execute("DELETE FROM memory_keys")
+                    cursor.execute("DELETE FROM memory_children")
+                    for key, value in marshal.loads(data).items():
+                        self._insert_key(cursor, key, value)
+
+                elif unit[0] == "key":
+                    key = unit[1]
+                    cursor.execute("DELETE FROM memory_keys WHERE key = ?", (key,))
+                    cursor.execute("DELETE FROM memory_children WHERE key = ?", (key,))
+                    if data is not None:
+                        self._insert_key(cursor, key, marshal.loads(data))
+
+                elif data is None:
+                    cursor.execute("DELETE FROM memory_children WHERE key = ? AND child = ?", unit[1:])
+
+                else:
+                    cursor.execute("INSERT OR REPLACE INTO memory_keys (key, value) VALUES (?, NULL)", unit[1:2])
+                    cursor.execute("INSERT OR REPLACE INTO memory_children (key, child, value) VALUES (?, ?, ?)",
+                                   unit[1:] + (json.dumps(marshal.loads(data), sort_keys=True),))
+
+
+class ShardedConfig(Config):
+    """memory storage as a directory of json files
+
+    every top-level key is written to its own file. the larger per-user/per-conversation
+    keys are further split into shards by a hash of the child key, so save() only rewrites
+    the files holding changed data. each file wraps its data as
+        { "key": <top-level key>, "shard": <shard number or null>, "value": <data> }
+    a sharded key also keeps an empty container file (shard null), so it survives being empty
+
+    the children of every shard are indexed, so a changed child only rewrites its shard
+    without scanning the other children of the key
+    """
+
+    sharded_keys = ("user_data", "conv_data", "convmem")
+
+    def __init__(self, filename, default=None, failsafe_backups=0, save_delay=0, journal=False,
+                 binary_snapshot=False, shards=32):
+        self.shards = shards
+        self._files = {}
+        self._shard_cache = {}
+        self._members = {} # { key: { shard: set of children } }, built on first use
+
+        if failsafe_backups or journal or binary_snapshot:
+            logger.info("{} failsafe backups, journal and snapshots are not used by sharded storage".format(filename))
+
+        super().__init__(filename, default=default, save_delay=save_delay)
+
+    def _shard(self, child):
+        try:
+            return self._shard_cache[child]
+        except KeyError:
+            # hashed as json writes the key, so it is found in the same shard after a reload
+            shard = self._shard_cache[child] = zlib.crc32(_json_key(child).encode()) % self.shards
+            return shard
+
+    def _shard_filename(self, key, shard):
+        name = "".join(c if c.isalnum() or c in "-_." else "_" for c in key)
+        if shard is None:
+            name = "{}.{:08x}.json".format(name, zlib.crc32(key.encode()))
+        else:
+            name = "{}.{:08x}.{:03d}.json".format(name, zlib.crc32(key.encode()), shard)
+        return os.path.join(self.filename, name)
+
+    def load(self, recovery=False):
+        """Load memory from all files in the directory"""
+        writer.wait(self)
+        os.makedirs(self.filename, exist_ok=True)
+
+        data = {}
+        self._files = {}
+        for name in sorted(os.listdir(self.filename)):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.filename, name)
+            with open(path) as f:
+                wrapped = json.load(f)
+            key, shard = wrapped["key"], wrapped["shard"]
+            if shard is None and not (isinstance(data.get(key), dict) and isinstance(wrapped["value"], dict)):
+                data[key] = wrapped["value"]
+            else:
+                data.setdefault(key, {}).update(wrapped["value"])
+            self._files[(key, shard)] = path
+
+        self.config = data
+        self._members = {}
+        self._reset_dirty()
+
+        logger.info("{} read {} files".format(self.filename, len(self._files)))
+
+    def is_new(self):
+        """True if the directory holds no files yet, it is created on load"""
+        try:
+            return not any(name.endswith(".json") for name in os.listdir(self.filename))
+        except OSError:
+            return True
+
+    def _snapshot_file(self, jobs, key, shard, value):
+        path = self._shard_filename(key, shard)
+        jobs[path] = freeze({ "key": key, "shard": shard, "value": value })
+        self._files[(key, shard)] = path
+
+    def _snapshot_remove(self, jobs, key, keep=()):
+        for key_shard in [ key_shard for key_shard in self._files
+                           if key_shard[0] == key and key_shard not in keep ]:
+            jobs[self._files.pop(key_shard)] = None
+
+    def _index_members(self, key):
+        """{ shard: set of children } of a sharded key, built from the data on first use"""
+        try:
+            return self._members[key]
+        except KeyError:
+            members = self._members[key] = {}
+            for child in self.config[key]:
+                members.setdefault(self._shard(child), set()).add(child)
+            return members
+
+    def _snapshot_key(self, jobs, key):
+        if key not in self.config:
+            self._members.pop(key, None)
+            self._snapshot_remove(jobs, key)
+
+        elif key in self.sharded_keys and isinstance(self.config[key], dict):
+            self._members.pop(key, None)
+            members = self._index_members(key)
+            for shard in list(members):
+                self._snapshot_shard(jobs, key, shard)
+            self._snapshot_file(jobs, key, None, {})
+            self._snapshot_remove(jobs, key, keep=[ (key, shard) for shard in members ] + [ (key, None) ])
+
+        else:
+            self._members.pop(key, None)
+            self._snapshot_file(jobs, key, None, self.config[key])
+            self._snapshot_remove(jobs, key, keep=[ (key, None) ])
+
+    def _snapshot_shard(self, jobs, key, shard):
+        """write the indexed children of a shard, keyed as json writes them"""
+        values = self.config[key]
+        children = self._members[key].get(shard)
+        if children:
+            self._snapshot_file(jobs, key, shard, { _json_key(child): values[child] for child in children })
+        else:
+            self._members[key].pop(shard, None)
+            path = self._files.pop((key, shard), None)
+            if path is not None:
+                jobs[path] = None
+
+    def _snapshot(self):
+        """capture only the files holding changed keys/shards, as path: marshalled content
+        (None removes the file). the file index is kept up to date on the calling thread
+        """
+        dirty, dirty_all = self._take_dirty()
+        jobs = collections.OrderedDict()
+
+        if dirty_all:
+            whole_keys = set(self.config) | set(key for key, shard in self._files)
+        else:
+            whole_keys = set(path[0] for path, used in dirty.items()
+                             if len(path) == 1
+                                or path[0] not in self.sharded_keys
+                                or not isinstance(self.config.get(used[0]), dict))
+
+        for key in whole_keys:
+            self._snapshot_key(jobs, key)
+
+        if not dirty_all:
+            shard_keys = set()
+            for path, used in dirty.items():
+                if path[0] in whole_keys:
+                    continue
+                key, child = used
+                shard = self._shard(child)
+                members = self._index_members(key)
+                if child in self.config[key]:
+                    members.setdefault(shard, set()).add(child)
+                elif shard in members:
+                    members[shard].discard(child)
+                shard_keys.add((key, shard))
+
+            for shard_key in shard_keys:
+                self._snapshot_shard(jobs, *shard_key)
+
+        logger.debug("{} snapshot {} keys, {} paths, {} files".format(
+            self.filename, len(whole_keys), len(dirty), len(jobs)))
+
+        return jobs
+
+    def _write_snapshot(self, jobs):
+        """write/remove the captured files, runs on the StorageWriter thread"""
+        for path, data in jobs.items():
+            if data is None:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            else:
+                atomic_write_json(path, marshal.loads(data))
+
+
+def split_storage_uri(uri):
+    """split a storage argument into (engine, path), plain paths use the json engine"""
+    if "://" in uri:
+        engine, path = uri.split("://", 1)
+        return engine.lower(), path
+    return "json", uri
+
+
+def open_storage(uri, **kwargs):
+    """return the Config for a path or an engine uri, e.g. sqlite:///path/to/memory.db
+    or shards:///path/to/memory-directory
+    """
+    engine, path = split_storage_uri(uri)
+    if engine == "json":
+        return Config(path, **kwargs)
+    elif engine == "sqlite":
+        return SQLiteConfig(path, **kwargs)
+    elif engine == "shards":
+        return ShardedConfig(path, **kwargs)
+    raise ValueError("unknown storage engine: {}".format(engine))
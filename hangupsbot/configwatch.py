@@ -0,0 +1,229 @@
+"""watch config.json and apply external edits to the running bot
+
+edits are applied as a structural diff through set_by_path()/pop_by_path(), so only the
+changed options are touched (cached config views are refreshed as usual) and every change
+is announced to plugins through the "configchange" handler:
+
+    def _initialise(bot):
+        plugins.register_handler(_config_changed, type="configchange")
+
+    def _config_changed(bot, change):
+        if change.path[:1] == ["sync_rooms"]:
+            ...
+
+enable with the config option "config.hot-reload": true
+"""
+
+import asyncio, collections, hashlib, json, logging, os, struct
+
+
+logger = logging.getLogger(__name__)
+
+
+Change = collections.namedtuple("Change", ["operation", "path", "old", "new"])
+Change.__doc__ = """a single config change, operation is "set" or "pop"
+    old is None for added options, new is None for removed options
+    """
+
+
+def diff(old, new, path=None):
+    """yield the changes required to turn old into new
+    dicts are compared key by key, everything else (lists, values) is compared as a whole
+    """
+    path = path or []
+
+    for key in old:
+        if key not in new:
+            yield Change("pop", path + [key], old[key], None)
+
+    for key in new:
+        if key not in old:
+            yield Change("set", path + [key], None, new[key])
+        elif isinstance(old[key], dict) and isinstance(new[key], dict):
+            yield from diff(old[key], new[key], path + [key])
+        elif old[key] != new[key] or type(old[key]) is not type(new[key]):
+            yield Change("set", path + [key], old[key], new[key])
+
+
+def apply(config, changes):
+    """apply changes from diff() to a Config"""
+    for change in changes:
+        if change.operation == "pop":
+            config.pop_by_path(change.path)
+        else:
+            config.set_by_path(change.path, change.new)
+
+
+try:
+    import ctypes, ctypes.util
+
+    _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    _libc.inotify_init1.restype = ctypes.c_int
+    _libc.inotify_add_watch.restype = ctypes.c_int
+    _libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+
+except (AttributeError, OSError):
+    # not linux
+    _libc = None
+
+
+class ConfigWatcher:
+    """reload a Config when its file is changed by someone else
+
+    uses inotify on the directory of the file (editors often replace the file instead of
+    writing to it), or polls the file if inotify is not available
+    """
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    _event_header = struct.Struct("iIII")
+
+    poll_interval = 5
+    debounce = 0.5
+
+    def __init__(self, bot, config):
+        self.bot = bot
+        self.config = config
+        self.reloads = 0
+
+        self._loop = asyncio.get_event_loop()
+        self._fd = None
+        self._poll_task = None
+        self._pending = None
+        self._stat = None
+
+    def start(self):
+        if self._fd is not None or self._poll_task is not None:
+            return
+
+        if _libc is not None:
+            try:
+                self._start_inotify()
+                logger.info("watching {} with inotify".format(self.config.filename))
+                return
+            except OSError as e:
+                logger.warning("inotify unavailable ({}), polling {}".format(e, self.config.filename))
+
+        self._stat = self._file_stat()
+        self._poll_task = asyncio.async(self._poll())
+        logger.info("polling {} every {}s".format(self.config.filename, self.poll_interval))
+
+    def stop(self):
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            self._poll_task = None
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+
+    def _start_inotify(self):
+        fd = _libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+
+        directory = os.path.dirname(os.path.abspath(self.config.filename))
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        if _libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, "inotify_add_watch {}".format(directory))
+
+        self._fd = fd
+        self._loop.add_reader(fd, self._on_inotify)
+
+    def _on_inotify(self):
+        filename = os.fsencode(os.path.basename(self.config.filename))
+        changed = False
+
+        while True:
+            try:
+                data = os.read(self._fd, 4096)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = self._event_header.unpack_from(data, offset)
+                offset += self._event_header.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                if name == filename:
+                    changed = True
+
+        if changed:
+            self._schedule_reload()
+
+    def _file_stat(self):
+        try:
+            stat = os.stat(self.config.filename)
+        except OSError:
+            return None
+        return (stat.st_mtime, stat.st_size, stat.st_ino)
+
+    @asyncio.coroutine
+    def _poll(self):
+        while True:
+            yield from asyncio.sleep(self.poll_interval)
+            stat = self._file_stat()
+            if stat != self._stat:
+                self._stat = stat
+                self._schedule_reload()
+
+    def _schedule_reload(self):
+        """wait for a burst of writes (editor save, atomic replace) to settle"""
+        if self._pending is not None:
+            self._pending.cancel()
+        self._pending = self._loop.call_later(self.debounce, lambda: asyncio.async(self.reload()))
+
+    @asyncio.coroutine
+    def reload(self):
+        """apply the changes of the file to the config and notify plugins"""
+        self._pending = None
+
+        try:
+            with open(self.config.filename, 'rb') as f:
+                content = f.read()
+        except IOError as e:
+            logger.warning("{} unreadable: {}".format(self.config.filename, e))
+            return []
+
+        checksum = hashlib.sha256(content).hexdigest()
+        if checksum == self.config._checksum:
+            # our own save, or nothing changed
+            return []
+
+        if self.config.changed:
+            # the pending save will overwrite the edit, applying it would revert unsaved changes
+            logger.warning("{} edited while the bot has unsaved changes, edit ignored".format(self.config.filename))
+            return []
+
+        try:
+            data = json.loads(content.decode("utf-8"))
+        except ValueError as e:
+            logger.warning("{} not reloaded, invalid json: {}".format(self.config.filename, e))
+            return []
+
+        changes = list(diff(self.config.config, data))
+        apply(self.config, changes)
+        # the file already holds the new data
+        self.config.mark_saved(checksum)
+        self.reloads += 1
+
+        logger.info("{} reloaded, {} changes".format(self.config.filename, len(changes)))
+
+        for change in changes:
+            logger.info("config {} {}".format(change.operation, ".".join(str(key) for key in change.path)))
+            if self.bot._handlers:
+                yield from self.bot._handlers.run_pluggable_omnibus("configchange", self.bot, change)
+
+        return changes
@@ -6,17 +6,36 @@ import hangups
 logger = logging.getLogger(__name__)
 
 
+_unset = object()
+
+
 class GenericEvent:
-    bot = None
+    """base class for all events
+
+    events have __slots__, conv, user and text are only looked up when they are used.
+    attributes that plugins add to an event (e.g. event.acknowledge, event._syncroom_no_repeat)
+        go to the extensions dict, which is only allocated when the first one is set
+    """
+
+    __slots__ = ("bot", "__dict__")
+
     emit_log = logging.INFO
 
     def __init__(self, bot):
         self.bot = bot
 
+    @property
+    def extensions(self):
+        """attributes added to the event besides the predefined ones"""
+        return self.__dict__
+
 
 class StatusEvent(GenericEvent):
     """base class for all non-ConversationEvent"""
 
+    __slots__ = ("conv_event", "conv_id", "conv", "event_id", "user_id", "_user",
+                 "timestamp", "text", "_from_bot")
+
     def __init__(self, bot, state_update_event):
         super().__init__(bot)
 
@@ -25,57 +44,107 @@ class StatusEvent(GenericEvent):
         self.conv = None
         self.event_id = None
         self.user_id = None
-        self.user = None
+        self._user = _unset
         self.timestamp = None
         self.text = ''
-        self.from_bot = False
+        self._from_bot = _unset
+
+    @property
+    def user(self):
+        if self._user is _unset:
+            self._user = None if self.user_id is None else self.bot.get_hangups_user(self.user_id)
+        return self._user
+
+    @user.setter
+    def user(self, user):
+        self._user = user
+
+    @property
+    def from_bot(self):
+        if self._from_bot is _unset:
+            self._from_bot = bool(self.user and self.user.is_self)
+        return self._from_bot
+
+    @from_bot.setter
+    def from_bot(self, from_bot):
+        self._from_bot = from_bot
 
 
 class TypingEvent(StatusEvent):
     """user starts/pauses/stops typing"""
 
+    __slots__ = ()
+
     def __init__(self, bot, state_update_event):
         super().__init__(bot, state_update_event)
 
         self.user_id = state_update_event.user_id
         self.timestamp = state_update_event.timestamp
-        self.user = self.bot.get_hangups_user(state_update_event.user_id)
-        if self.user.is_self:
-            self.from_bot = True
         self.text = "typing"
 
 
 class WatermarkEvent(StatusEvent):
     """user reads up to a certain point in the conversation"""
 
+    __slots__ = ()
+
     def __init__(self, bot, state_update_event):
         super().__init__(bot, state_update_event)
 
         self.user_id = state_update_event.participant_id
         self.timestamp = state_update_event.latest_read_timestamp
-        self.user = self.bot.get_hangups_user(state_update_event.participant_id)
-        if self.user.is_self:
-            self.from_bot = True
         self.text = "watermark"
 
 
 class ConversationEvent(GenericEvent):
     """user joins, leaves, renames or messages a conversation"""
 
+    __slots__ = ("conv_event", "conv_id", "_conv", "event_id", "user_id", "_user",
+                 "timestamp", "_text", "from_bot")
+
     def __init__(self, bot, conv_event):
         super().__init__(bot)
 
         self.conv_event = conv_event
         self.conv_id = conv_event.conversation_id
-        self.conv = self.bot._conv_list.get(self.conv_id)
+        self._conv = _unset
         self.event_id = conv_event.id_
         self.user_id = conv_event.user_id
-        self.user = self.conv.get_user(self.user_id)
+        self._user = _unset
         self.timestamp = conv_event.timestamp
-        self.text = conv_event.text.strip() if isinstance(conv_event, hangups.ChatMessageEvent) else ''
+        self._text = _unset
 
         self.log()
 
+    @property
+    def conv(self):
+        if self._conv is _unset:
+            self._conv = self.bot._conv_list.get(self.conv_id)
+        return self._conv
+
+    @conv.setter
+    def conv(self, conv):
+        self._conv = conv
+
+    @property
+    def user(self):
+        if self._user is _unset:
+            self._user = self.conv.get_user(self.user_id)
+        return self._user
+
+    @user.setter
+    def user(self, user):
+        self._user = user
+
+    @property
+    def text(self):
+        if self._text is _unset:
+            self._text = self.conv_event.text.strip() if isinstance(self.conv_event, hangups.ChatMessageEvent) else ''
+        return self._text
+
+    @text.setter
+    def text(self, text):
+        self._text = text
 
     def log(self):
         if logger.isEnabledFor(self.emit_log):
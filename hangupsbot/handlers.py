@@ -1,11 +1,14 @@
 import logging
-import shlex
 import asyncio
+import collections
 import inspect
+import re
+import time
 import uuid
 
 import hangups
 
+import commandparser
 import plugins
 from commands import command
 
@@ -13,6 +16,148 @@ from commands import command
 logger = logging.getLogger(__name__)
 
 
+class HandlerFilter:
+    """declarative checks an event must pass before a handler is called
+
+    supported filters, all given ones must match:
+    * "conv_ids": list of conversation ids the handler is limited to
+    * "conv_tags": the conversation must have at least one of these tags
+    * "from_bot": True/False, compared with event.from_bot, or event.user.is_self if unset
+    * "prefix": string or tuple of strings event.text must start with
+    * "regex": string or compiled pattern searched in event.text, strings are case-insensitive
+    * "config": conversation config option that must be set, e.g. "forwarding_enabled"
+    """
+
+    def __init__(self, conv_ids=None, conv_tags=None, from_bot=None, prefix=None, regex=None, config=None):
+        self.conv_ids = frozenset(conv_ids) if conv_ids is not None else None
+        self.conv_tags = frozenset([conv_tags] if isinstance(conv_tags, str) else conv_tags) if conv_tags else None
+        self.from_bot = from_bot
+        self.prefix = tuple([prefix] if isinstance(prefix, str) else prefix) if prefix else None
+        self.regex = re.compile(regex, re.IGNORECASE) if isinstance(regex, str) else regex
+        self.config = config
+
+    def __call__(self, bot, event):
+        # cheapest checks first
+        if self.conv_ids is not None and event.conv_id not in self.conv_ids:
+            return False
+        if self.from_bot is not None:
+            from_bot = getattr(event, "from_bot", None)
+            if from_bot is None:
+                from_bot = bool(event.user and event.user.is_self)
+            if from_bot != self.from_bot:
+                return False
+        if self.prefix is not None and not event.text.startswith(self.prefix):
+            return False
+        if self.regex is not None and self.regex.search(event.text) is None:
+            return False
+        if self.config is not None and not bot.get_config_suboption(event.conv_id, self.config):
+            return False
+        if self.conv_tags is not None and self.conv_tags.isdisjoint(bot.tags.convactive(event.conv_id)):
+            return False
+        return True
+
+
+class HandlerRecord(collections.namedtuple("HandlerRecord", ["function", "priority", "metadata"])):
+    """registered handler, inspected once at registration for dispatch
+    still unpacks and indexes like the legacy (function, priority, metadata) tuple
+
+    concurrent marks a coroutine handler as safe to run alongside other concurrent handlers
+        of the same priority, see EventHandler.run_pluggable_omnibus()
+    filters is a dict of HandlerFilter arguments, the handler is skipped for events that
+        do not match
+    """
+
+    def __new__(cls, function, priority, metadata, concurrent=False, filters=None):
+        record = super().__new__(cls, function, priority, metadata)
+
+        """accepted handler signatures:
+        coroutine(bot, event, command)
+        coroutine(bot, event)
+        function(bot, event, context)
+        function(bot, event)
+        """
+        record.arity = len(inspect.signature(function).parameters)
+        record.coroutine = asyncio.iscoroutinefunction(function)
+        record.label = "{}.{}".format(metadata["module.path"], function.__name__)
+        record.concurrent = bool(concurrent) and record.coroutine
+        record.filter = HandlerFilter(**filters) if filters else None
+
+        return record
+
+
+class ReprocessorRegistry:
+    """reprocessors by id, in registration order
+
+    a reprocessor is removed when its message comes back, otherwise it expires after ttl
+        seconds. at most maxsize reprocessors are kept, the oldest ones are evicted first
+    """
+
+    def __init__(self, ttl=3600, maxsize=10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+
+        self._entries = collections.OrderedDict() # id: (callable, expiry)
+
+        self.registered = 0
+        self.run = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, id):
+        return id in self._entries
+
+    def register(self, callable):
+        now = time.time()
+        self.expire(now)
+
+        id = str(uuid.uuid4())
+        self._entries[id] = (callable, now + self.ttl)
+        self.registered += 1
+
+        if len(self._entries) > self.maxsize:
+            _id, _ = self._entries.popitem(last=False)
+            self.evicted += 1
+            logger.warning("too many reprocessors, evicted {}".format(_id))
+
+        return id
+
+    def pop(self, id):
+        """remove and return the callable registered as id, or None if there is none or it
+        expired
+        """
+        entry = self._entries.pop(id, None)
+        if entry is None:
+            return None
+        if entry[1] <= time.time():
+            self.expired += 1
+            logger.debug("reprocessor {} expired".format(id))
+            return None
+        self.run += 1
+        return entry[0]
+
+    def expire(self, now=None):
+        now = now or time.time()
+        entries = self._entries
+        while entries:
+            id = next(iter(entries))
+            if entries[id][1] > now:
+                break
+            del entries[id]
+            self.expired += 1
+            logger.debug("reprocessor {} expired".format(id))
+
+    def stats(self):
+        self.expire()
+        return { "active": len(self._entries),
+                 "registered": self.registered,
+                 "run": self.run,
+                 "expired": self.expired,
+                 "evicted": self.evicted }
+
+
 class EventHandler:
     """Handle Hangups conversation events"""
 
@@ -21,10 +166,13 @@ class EventHandler:
         self.bot_command = bot_command
 
         self._prefix_reprocessor = "uuid://"
-        self._reprocessors = {}
+        self._reprocessors = ReprocessorRegistry(
+            ttl = int(bot.get_config_option("reprocessor.ttl") or 3600),
+            maxsize = int(bot.get_config_option("reprocessor.maxsize") or 10000))
 
         self.pluggables = { "allmessages": [],
                             "call": [],
+                            "configchange": [],
                             "membership": [],
                             "message": [],
                             "rename": [],
@@ -37,9 +185,29 @@ class EventHandler:
                              forgiving=True )
 
 
-    def register_handler(self, function, type="message", priority=50):
-        """registers extra event handlers"""
-        if type in ["allmessages", "call", "membership", "message", "rename", "typing", "watermark"]:
+    @property
+    def bot_command(self):
+        return self._bot_command
+
+    @bot_command.setter
+    def bot_command(self, aliases):
+        # ensure bot alias is always a list
+        if not isinstance(aliases, list):
+            aliases = [aliases]
+        self._bot_command = aliases
+        self._command_parser = commandparser.CommandParser(aliases)
+
+    def register_handler(self, function, type="message", priority=50, concurrent=False, filters=None):
+        """registers extra event handlers
+        concurrent = True marks the handler as safe to run concurrently with other handlers of
+            the same priority, this is used if the config option handlers.concurrent is set
+        filters = { "regex": ..., "from_bot": False, ... } skips the handler for events that do
+            not match, see HandlerFilter
+        """
+        if filters and type in ["configchange", "sending"]:
+            raise ValueError("{} handlers do not support filters".format(type))
+
+        if type in ["allmessages", "call", "configchange", "membership", "message", "rename", "typing", "watermark"]:
             if not asyncio.iscoroutine(function):
                 # transparently convert into coroutine
                 function = asyncio.coroutine(function)
@@ -50,15 +218,13 @@ class EventHandler:
             raise ValueError("unknown event type for handler: {}".format(type))
 
         current_plugin = plugins.tracking.current()
-        self.pluggables[type].append((function, priority, current_plugin["metadata"]))
+        self.pluggables[type].append(HandlerRecord(function, priority, current_plugin["metadata"], concurrent, filters))
         self.pluggables[type].sort(key=lambda tup: tup[1])
 
         plugins.tracking.register_handler(function, type, priority)
 
     def register_reprocessor(self, callable):
-        _id = str(uuid.uuid4())
-        self._reprocessors[_id] = callable
-        return _id
+        return self._reprocessors.register(callable)
 
     def attach_reprocessor(self, callable, return_as_dict=False):
         """reprocessor: map callable to a special hidden context link that can be added anywhere 
@@ -107,14 +273,26 @@ class EventHandler:
 
     @asyncio.coroutine
     def run_reprocessor(self, id, event, *args, **kwargs):
-        if id in self._reprocessors:
-            is_coroutine = asyncio.iscoroutinefunction(self._reprocessors[id])
+        reprocessor = self._reprocessors.pop(id)
+        if reprocessor is not None:
+            is_coroutine = asyncio.iscoroutinefunction(reprocessor)
             logger.info("reprocessor uuid found: {} coroutine={}".format(id, is_coroutine))
             if is_coroutine:
-                yield from self._reprocessors[id](self.bot, event, id, *args, **kwargs)
+                yield from reprocessor(self.bot, event, id, *args, **kwargs)
             else:
-                self._reprocessors[id](self.bot, event, id, *args, **kwargs)
-            del self._reprocessors[id]
+                reprocessor(self.bot, event, id, *args, **kwargs)
+
+    def reprocessor_ids(self, segments):
+        """return the ids of registered reprocessors linked from segments, only link segments
+        are looked at
+        """
+        if not self._reprocessors:
+            return []
+        link = hangups.SegmentType.LINK
+        prefix = self._prefix_reprocessor
+        skip = len(prefix)
+        return [ segment.link_target[skip:] for segment in segments
+                 if segment.type_ == link and segment.link_target and segment.link_target.startswith(prefix) ]
 
     @asyncio.coroutine
     def handle_chat_message(self, event):
@@ -126,27 +304,28 @@ class EventHandler:
                 event.from_bot = False
 
             """reprocessor - process event with hidden context from handler.attach_reprocessor()"""
-            if len(event.conv_event.segments) > 0:
-                for segment in event.conv_event.segments:
-                    if segment.link_target:
-                        if segment.link_target.startswith(self._prefix_reprocessor):
-                            _id = segment.link_target[len(self._prefix_reprocessor):]
-                            yield from self.run_reprocessor(_id, event)
+            for _id in self.reprocessor_ids(event.conv_event.segments):
+                yield from self.run_reprocessor(_id, event)
 
             """auto opt-in - opted-out users who chat with the bot will be opted-in again"""
             if not event.from_bot and self.bot.conversations.catalog[event.conv_id]["type"] == "ONE_TO_ONE":
-                if self.bot.memory.exists(["user_data", event.user.id_.chat_id, "optout"]):
-                    optout = self.bot.memory.get_by_path(["user_data", event.user.id_.chat_id, "optout"])
-                    if isinstance(optout, bool) and optout:
-                        yield from command.run(self.bot, event, *["optout"])
-                        logger.info("auto opt-in for {}".format(event.user.id_.chat_id))
-                        return
+                optout = self.bot.memory.path("user_data", "*", "optout").get(event.user.id_.chat_id)
+                if isinstance(optout, bool) and optout:
+                    yield from command.run(self.bot, event, *["optout"])
+                    logger.info("auto opt-in for {}".format(event.user.id_.chat_id))
+                    return
 
             yield from self.run_pluggable_omnibus("allmessages", self.bot, event, command)
             if not event.from_bot:
                 yield from self.run_pluggable_omnibus("message", self.bot, event, command)
                 yield from self.handle_command(event)
 
+    @asyncio.coroutine
+    def _parse_error(self, event, error):
+        logger.exception(error)
+        yield from self.bot.coro_send_message(event.conv, _("{}: {}").format(
+            event.user.full_name, str(error)))
+
     @asyncio.coroutine
     def handle_command(self, event):
         """Handle command messages"""
@@ -162,26 +341,26 @@ class EventHandler:
             if event.user_id.chat_id not in admins_list:
                 return
 
-        # ensure bot alias is always a list
-        if not isinstance(self.bot_command, list):
-            self.bot_command = [self.bot_command]
+        # check that a bot alias is used e.g. /bot, the message is parsed in the same pass
+        text = event.text.replace(u'\xa0', u' ') # convert non-breaking space in Latin1 (ISO 8859-1)
+        try:
+            line_args = self._command_parser.parse(text)
+        except Exception as e:
+            yield from self._parse_error(event, e)
+            return
 
-        # check that a bot alias is used e.g. /bot
-        if not event.text.split()[0].lower() in self.bot_command:
+        if line_args is None:
             if self.bot.conversations.catalog[event.conv_id]["type"] == "ONE_TO_ONE" and self.bot.get_config_option('auto_alias_one_to_one'):
-                event.text = u" ".join((self.bot_command[0], event.text)) # Insert default alias if not already present
+                text = u" ".join((self.bot_command[0], text)) # Insert default alias if not already present
+                try:
+                    line_args = commandparser.split(text)
+                except Exception as e:
+                    yield from self._parse_error(event, e)
+                    return
             else:
                 return
 
-        # Parse message
-        event.text = event.text.replace(u'\xa0', u' ') # convert non-breaking space in Latin1 (ISO 8859-1)
-        try:
-            line_args = shlex.split(event.text, posix=False)
-        except Exception as e:
-            logger.exception(e)
-            yield from self.bot.coro_send_message(event.conv, _("{}: {}").format(
-                event.user.full_name, str(e)))
-            return
+        event.text = text
 
         # Test if command length is sufficient
         if len(line_args) < 2:
@@ -241,51 +420,133 @@ class EventHandler:
     @asyncio.coroutine
     def run_pluggable_omnibus(self, name, *args, **kwargs):
         if name in self.pluggables:
-            try:
-                for function, priority, plugin_metadata in self.pluggables[name]:
-                    message = ["{}: {}.{}".format(
-                                name,
-                                plugin_metadata["module.path"],
-                                function.__name__)]
+            # no per-handler string formatting unless it is actually logged
+            debug = logger.isEnabledFor(logging.DEBUG)
 
+            if self.bot.get_config_option("handlers.concurrent"):
+                yield from self.run_pluggable_bands(name, args, debug)
+                return
+
+            record = None
+            try:
+                for record in self.pluggables[name]:
+                    if self._filtered(name, record, args, debug):
+                        continue
                     try:
-                        """accepted handler signatures:
-                        coroutine(bot, event, command)
-                        coroutine(bot, event)
-                        function(bot, event, context)
-                        function(bot, event)
-                        """
-                        _expected = list(inspect.signature(function).parameters)
-                        _passed = args[0:len(_expected)]
-                        if asyncio.iscoroutinefunction(function):
-                            message.append("coroutine")
-                            logger.debug(" : ".join(message))
-                            yield from function(*_passed)
+                        if record.coroutine:
+                            if debug:
+                                logger.debug("{}: {} : coroutine".format(name, record.label))
+                            yield from record.function(*args[0:record.arity])
                         else:
-                            message.append("function")
-                            logger.debug(" : ".join(message))
-                            function(*_passed)
+                            if debug:
+                                logger.debug("{}: {} : function".format(name, record.label))
+                            record.function(*args[0:record.arity])
                     except self.bot.Exceptions.SuppressHandler:
                         # skip this pluggable, continue with next
-                        message.append("SuppressHandler")
-                        logger.debug(" : ".join(message))
-                        pass
+                        if debug:
+                            logger.debug("{}: {} : SuppressHandler".format(name, record.label))
                     except (self.bot.Exceptions.SuppressEventHandling,
                             self.bot.Exceptions.SuppressAllHandlers):
                         # skip all pluggables, decide whether to handle event at next level
                         raise
                     except:
-                        message = " : ".join(message)
-                        logger.exception(message)
+                        logger.exception("{}: {}".format(name, record.label))
 
             except self.bot.Exceptions.SuppressAllHandlers:
                 # skip all other pluggables, but let the event continue
-                message.append("SuppressAllHandlers")
-                logger.debug(" : ".join(message))
+                if debug:
+                    logger.debug("{}: {} : SuppressAllHandlers".format(name, record.label))
 
             except:
                 raise
 
+    def _filtered(self, name, record, args, debug):
+        """True if the handler is skipped for this event, a failing filter only skips its handler"""
+        if record.filter is None:
+            return False
+        try:
+            if record.filter(args[0], args[1]):
+                return False
+        except Exception:
+            logger.exception("{}: {} : filter".format(name, record.label))
+            return True
+        if debug:
+            logger.debug("{}: {} : filtered".format(name, record.label))
+        return True
+
+    @staticmethod
+    def _dispatch_groups(records):
+        """split sorted handlers into groups: consecutive concurrent handlers of the same
+        priority form one group, any other handler is a group of its own
+        """
+        group = []
+        for record in records:
+            if group and record.concurrent and group[-1].concurrent and record.priority == group[-1].priority:
+                group.append(record)
+                continue
+            if group:
+                yield group
+            group = [ record ]
+        if group:
+            yield group
+
+    @asyncio.coroutine
+    def _run_handler(self, name, record, args, debug):
+        try:
+            if debug:
+                logger.debug("{}: {} : {}".format(name, record.label, "coroutine" if record.coroutine else "function"))
+            if record.coroutine:
+                yield from record.function(*args[0:record.arity])
+            else:
+                record.function(*args[0:record.arity])
+        except self.bot.Exceptions.SuppressHandler:
+            if debug:
+                logger.debug("{}: {} : SuppressHandler".format(name, record.label))
+        except (self.bot.Exceptions.SuppressEventHandling,
+                self.bot.Exceptions.SuppressAllHandlers):
+            raise
+        except:
+            logger.exception("{}: {}".format(name, record.label))
+
+    @asyncio.coroutine
+    def run_pluggable_bands(self, name, args, debug=False):
+        """run handlers by priority, concurrent handlers of the same priority run together
+
+        priorities still run in order. when a handler of a concurrent group raises
+            SuppressHandler: only that handler is affected, as usual
+            SuppressAllHandlers: the rest of the group finishes, lower priorities are skipped
+            SuppressEventHandling: the rest of the group finishes, then it is raised to the caller
+        SuppressEventHandling wins if both are raised in the same group
+        """
+        group = None
+        try:
+            for group in self._dispatch_groups(list(self.pluggables[name])):
+                group = [ record for record in group if not self._filtered(name, record, args, debug) ]
+                if not group:
+                    continue
+                if len(group) == 1:
+                    yield from self._run_handler(name, group[0], args, debug)
+                    continue
+
+                if debug:
+                    logger.debug("{}: concurrent {}".format(name, ", ".join(record.label for record in group)))
+
+                results = yield from asyncio.gather(
+                    *[ self._run_handler(name, record, args, debug) for record in group ],
+                    return_exceptions=True)
+
+                for suppression in (self.bot.Exceptions.SuppressEventHandling,
+                                    self.bot.Exceptions.SuppressAllHandlers):
+                    for result in results:
+                        if isinstance(result, suppression):
+                            raise result
+
+        except self.bot.Exceptions.SuppressAllHandlers:
+            # skip all other pluggables, but let the event continue
+            if debug:
+                logger.debug("{}: {} : SuppressAllHandlers".format(name, ", ".join(record.label for record in group)))
+
+
 class HandlerBridge:
     """shim for xmikosbot handler decorator"""
 
@@ -1,4 +1,4 @@
-import asyncio, logging, time
+import asyncio, logging, time, weakref
 
 from collections import namedtuple
 
@@ -144,6 +144,10 @@ class HangupsConversation(hangups.conversation.Conversation):
         return [ self.bot.get_hangups_user(part.id_.chat_id) for part in self._conversation.participant_data ]
 
 
+# one lock per conversation id, kept as long as a send holds a reference to it
+_send_locks = weakref.WeakValueDictionary()
+
+
 class FakeConversation(object):
     def __init__(self, _client, id_):
         self._client = _client
@@ -151,7 +155,11 @@ class FakeConversation(object):
 
     @asyncio.coroutine
     def send_message(self, segments, image_id=None, otr_status=None):
-        with (yield from asyncio.Lock()):
+        lock = _send_locks.get(self.id_)
+        if lock is None:
+            lock = _send_locks[self.id_] = asyncio.Lock()
+
+        with (yield from lock):
             if segments:
                 serialised_segments = [seg.serialize() for seg in segments]
             else:
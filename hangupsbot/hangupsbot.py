@@ -6,14 +6,18 @@ import hangups
 from hangups.schemas import OffTheRecordStatus
 
 import config
+import configwatch
 import handlers
+import outbound
 import version
 
 import permamem
+import scheduler
 import tagging
 
 import hooks
 import sinks
+import parsers
 import plugins
 
 from exceptions import HangupsBotExceptions
@@ -46,8 +50,12 @@ class HangupsBot(object):
         self._conv_list = None # hangups.ConversationList
         self._user_list = None # hangups.UserList
         self._handlers = None # handlers.py::EventHandler
+        self._config_watcher = None # configwatch.py::ConfigWatcher
+        self._scheduler = None # scheduler.py::EventScheduler
+        self._coalescer = None # scheduler.py::StatusCoalescer
+        self._outbound = None # outbound.py::OutboundScheduler
 
-        self._cache_event_id = {} # workaround for duplicate events
+        self._duplicate_filter = scheduler.DuplicateFilter() # workaround for duplicate events
 
         self._locales = {}
 
@@ -63,19 +71,33 @@ class HangupsBot(object):
         if _language:
             self.set_locale(_language)
 
+        # parsed html of repeated outbound messages is reused, 0 disables the cache
+        _cache_size = self.get_config_option("parser.cache-size")
+        if _cache_size is not None:
+            parsers.segment_cache.maxsize = int(_cache_size)
+
         # load in previous memory, or create new one
         self.memory = None
         if memory_file:
             _failsafe_backups = int(self.get_config_option('memory-failsafe_backups') or 3)
             _save_delay = int(self.get_config_option('memory-save_delay') or 1)
+            _journal = self.get_config_option('memory-journal') or False
+            _binary_snapshot = bool(self.get_config_option('memory-binary_snapshot'))
+
+            logger.info("memory = {}, failsafe = {}, delay = {}, journal = {}, binary snapshot = {}".format(
+                memory_file, _failsafe_backups, _save_delay, _journal, _binary_snapshot))
 
-            logger.info("memory = {}, failsafe = {}, delay = {}".format(
-                memory_file, _failsafe_backups, _save_delay))
+            try:
+                self.memory = config.open_storage(memory_file, failsafe_backups=_failsafe_backups,
+                                                  save_delay=_save_delay, journal=_journal,
+                                                  binary_snapshot=_binary_snapshot)
+            except ValueError:
+                logger.exception("failed to load memory")
+                sys.exit(1)
 
-            self.memory = config.Config(memory_file, failsafe_backups=_failsafe_backups, save_delay=_save_delay)
-            if not os.path.isfile(memory_file):
+            if self.memory.is_new():
                 try:
-                    logger.info("creating memory file: {}".format(memory_file))
+                    logger.info("creating memory file: {}".format(self.memory.filename))
                     self.memory.force_taint()
                     self.memory.save()
 
@@ -143,6 +165,13 @@ class HangupsBot(object):
 
     def run(self):
         """Connect to Hangouts and run bot"""
+        try:
+            self._run()
+        finally:
+            # every exit: the save timers need the loop, the storage writer is a daemon thread
+            self._flush_storage()
+
+    def _run(self):
         cookies = self.login(self._cookies_path)
         if cookies:
             # Start asyncio event loop
@@ -152,6 +181,10 @@ class HangupsBot(object):
             hooks.load(self)
             sinks.start(self)
 
+            if self.get_config_option("config.hot-reload"):
+                self._config_watcher = configwatch.ConfigWatcher(self, self.config)
+                self._config_watcher.start()
+
             # Connect to Hangouts
             # If we are forcefully disconnected, try connecting again
             for retry in range(self._max_retries):
@@ -167,8 +200,8 @@ class HangupsBot(object):
 
                     loop.run_until_complete(plugins.unload_all(self))
 
-                    self.memory.flush()
-                    self.config.flush()
+                    if self._config_watcher:
+                        self._config_watcher.stop()
 
                     sys.exit(0)
                 except Exception as e:
@@ -177,6 +210,9 @@ class HangupsBot(object):
 
                     loop.run_until_complete(plugins.unload_all(self))
 
+                    # messages waiting for a retry are picked up again after a reconnect
+                    self._flush_outbound()
+
                     logger.info('Waiting {} seconds...'.format(5 + retry * 5))
                     time.sleep(5 + retry * 5)
                     logger.info('Trying to connect again (try {} of {})...'.format(retry + 1, self._max_retries))
@@ -187,6 +223,21 @@ class HangupsBot(object):
 
         sys.exit(1)
 
+    def _flush_storage(self):
+        """write pending memory and config saves and spool the outbound retries"""
+        for storage in (self.memory, self.config):
+            if storage is None:
+                continue
+            try:
+                storage.flush()
+            except Exception:
+                logger.exception("failed to flush {}".format(storage.filename))
+        self._flush_outbound()
+
+    def _flush_outbound(self):
+        if self._outbound and self._outbound.retry:
+            self._outbound.retry.flush()
+
     def stop(self):
         """Disconnect from Hangouts"""
         asyncio.async(
@@ -338,8 +389,17 @@ class HangupsBot(object):
     def get_config_option(self, option):
         return self.config.get_option(option)
 
+    def _get_config_number(self, option, default, cast=float):
+        """numeric option, default only if it is not set, so an explicit 0 is kept"""
+        value = self.get_config_option(option)
+        return cast(default if value is None else value)
+
     def get_config_suboption(self, conv_id, option):
-        return self.config.get_suboption("conversations", conv_id, option)
+        return self.config.get_view(conv_id).get(option)
+
+    def get_config_view(self, conv_id):
+        """return the resolved, read-only options of a conversation, see config.ConfigView"""
+        return self.config.get_view(conv_id)
 
     def get_memory_option(self, option):
         return self.memory.get_option(option)
@@ -526,6 +586,44 @@ class HangupsBot(object):
         self._handlers = handlers.EventHandler(self)
         handlers.handler.set_bot(self) # shim for handler decorator
 
+        if self._scheduler is None:
+            # events queued before a reconnect are still delivered in order
+            self._scheduler = scheduler.EventScheduler(
+                workers = int(self.get_config_option("events.workers") or 16),
+                max_pending = int(self.get_config_option("events.max-pending") or 1000),
+                shed_depth = int(self.get_config_option("events.shed-depth") or 20),
+                release_after = self._get_config_number("events.release-after", 5))
+
+        if self._coalescer is None:
+            # off unless configured, a window delays the last status of a burst
+            self._coalescer = scheduler.StatusCoalescer(
+                self._deliver_status, window = self._get_config_number("events.coalesce-window", 0))
+
+        if self._outbound is None:
+            self._outbound = outbound.OutboundScheduler(
+                self._send_segments,
+                rate = self._get_config_number("outbound.rate", 1),
+                burst = self._get_config_number("outbound.burst", 5, int),
+                global_rate = self._get_config_number("outbound.global-rate", 5),
+                global_burst = self._get_config_number("outbound.global-burst", 20, int),
+                concurrency = self._get_config_number("outbound.concurrency", 4, int),
+                coalesce_window = self._get_config_number("outbound.coalesce-window", 0),
+                coalesce_length = self._get_config_number("outbound.coalesce-length", 2000, int),
+                separator = [ hangups.ChatMessageSegment("\n", hangups.SegmentType.LINE_BREAK) ])
+
+            # messages that failed with a network error are retried, also after a restart
+            _spool = self.get_config_option("outbound.spool") or os.path.join(
+                os.path.dirname(os.path.abspath(self.memory.filename)), "outbound-spool")
+            self._outbound.retry = outbound.RetryQueue(
+                self._outbound.resubmit, self._encode_message, self._decode_message, _spool,
+                retryable = (hangups.NetworkError,),
+                attempts = self._get_config_number("outbound.retry-attempts", 5, int),
+                delay = self._get_config_number("outbound.retry-delay", 2),
+                max_delay = self._get_config_number("outbound.retry-max-delay", 300),
+                memory = self._get_config_number("outbound.retry-memory", 100, int),
+                dead_letters = self._get_config_number("outbound.dead-letters", 100, int))
+            self._outbound.retry.load()
+
         plugins.load(self, "monkeypatch.otr_support")
 
         self._user_list = yield from hangups.user.build_user_list(self._client,
@@ -553,20 +651,36 @@ class HangupsBot(object):
 
 
     def _on_status_changes(self, state_update):
-        if state_update.typing_notification is not None:
-            asyncio.async(
-                self._handlers.handle_typing_notification(
-                    TypingEvent(self, state_update.typing_notification)
-                )
-            ).add_done_callback(lambda future: future.result())
+        # no events are built for notifications that no handler is interested in
+        notification = state_update.typing_notification
+        if notification is not None and self._handlers.pluggables["typing"]:
+            self._coalescer.add("typing", notification.conversation_id.id_,
+                                notification.user_id.chat_id, notification)
+
+        notification = state_update.watermark_notification
+        if notification is not None and self._handlers.pluggables["watermark"]:
+            self._coalescer.add("watermark", notification.conversation_id.id_,
+                                notification.participant_id.chat_id, notification)
+
+
+    def _deliver_status(self, kind, notification):
+        """build the event of the latest coalesced status notification and queue it"""
+        if kind == "typing":
+            event = TypingEvent(self, notification)
+            self._scheduler.submit(event.conv_id, kind,
+                                   self._handle_event, "handle_typing_notification", event)
+        else:
+            event = WatermarkEvent(self, notification)
+            self._scheduler.submit(event.conv_id, kind,
+                                   self._handle_event, "handle_watermark_notification", event)
 
-        if state_update.watermark_notification is not None:
-            asyncio.async(
-                self._handlers.handle_watermark_notification(
-                    WatermarkEvent(self, state_update.watermark_notification)
-                )
-            ).add_done_callback(lambda future: future.result())
 
+    @asyncio.coroutine
+    def _handle_event(self, handler_name, event):
+        """run a queued event on the handlers that are current when it is dispatched, they are
+        replaced on reconnect
+        """
+        yield from getattr(self._handlers, handler_name)(event)
 
     @asyncio.coroutine
     def _on_event(self, conv_event):
@@ -575,14 +689,11 @@ class HangupsBot(object):
         self._execute_hook("on_event", conv_event)
 
         if self.get_config_option('workaround.duplicate-events'):
-            if conv_event.id_ in self._cache_event_id:
+            if self._duplicate_filter.is_duplicate(conv_event.id_):
                 logger.warning("duplicate event {} ignored".format(conv_event.id_))
                 return
 
-            self._cache_event_id = {k: v for k, v in self._cache_event_id.items() if v > time.time()-3}
-            self._cache_event_id[conv_event.id_] = time.time()
-
-            logger.info("duplicate events workaround: event id = {} timestamp = {}".format(
+            logger.debug("duplicate events workaround: event id = {} timestamp = {}".format(
                 conv_event.id_, conv_event.timestamp))
 
         event = ConversationEvent(self, conv_event)
@@ -591,28 +702,25 @@ class HangupsBot(object):
                                              source="event")
 
         if isinstance(conv_event, hangups.ChatMessageEvent):
+            self.conversations.mark_seen(event.user_id.chat_id)
             self._execute_hook("on_chat_message", event)
-            asyncio.async(
-                self._handlers.handle_chat_message(event)
-            ).add_done_callback(lambda future: future.result())
+            yield from self._scheduler.put(event.conv_id, "message",
+                                           self._handle_event, "handle_chat_message", event)
 
         elif isinstance(conv_event, hangups.MembershipChangeEvent):
             self._execute_hook("on_membership_change", event)
-            asyncio.async(
-                self._handlers.handle_chat_membership(event)
-            ).add_done_callback(lambda future: future.result())
+            yield from self._scheduler.put(event.conv_id, "membership",
+                                           self._handle_event, "handle_chat_membership", event)
 
         elif isinstance(conv_event, hangups.RenameEvent):
             self._execute_hook("on_rename", event)
-            asyncio.async(
-                self._handlers.handle_chat_rename(event)
-            ).add_done_callback(lambda future: future.result())
+            yield from self._scheduler.put(event.conv_id, "rename",
+                                           self._handle_event, "handle_chat_rename", event)
 
         elif type(conv_event) is hangups.conversation_event.ConversationEvent:
             if conv_event._event.hangout_event:
-                asyncio.async(
-                    self._handlers.handle_call(event)
-                ).add_done_callback(lambda future: future.result())
+                yield from self._scheduler.put(event.conv_id, "call",
+                                               self._handle_event, "handle_call", event)
 
         else:
             logger.warning("_on_event(): unrecognised event type: {}".format(type(conv_event)))
@@ -746,20 +854,73 @@ class HangupsBot(object):
 
         # begin message sending.. for REAL!
 
-        for response in broadcast_list:
-            logger.debug("message sending: {}".format(response[0]))
-
-            # send messages using FakeConversation as a workaround
-
-            _fc = FakeConversation(self._client, response[0])
+        importance = context["base"].get("importance", 50)
+        # context["coalesce"] = False keeps the message from being merged with others
+        coalesce = context.get("coalesce", True)
+
+        # targets are sent to concurrently. everything is queued here in list order, gather()
+        #   would start coroutines in no particular order and mix up entries to one target
+        futures = [ self._outbound.enqueue( response[0],
+                                            response[1],
+                                            image_id=image_id,
+                                            otr_status=otr_status,
+                                            importance=importance,
+                                            coalesce=coalesce )
+                    for response in broadcast_list ]
+        results = yield from asyncio.gather(*futures, return_exceptions=True)
+
+        error = None
+        for response, result in zip(broadcast_list, results):
+            if isinstance(result, Exception):
+                logger.error("CORO_SEND_MESSAGE: error sending {}".format(response[0]),
+                             exc_info=(type(result), result, result.__traceback__))
+                if not isinstance(result, hangups.NetworkError):
+                    error = error or result
+            else:
+                logger.debug("message sending: {}".format(response[0]))
 
-            try:
-                yield from _fc.send_message( response[1],
-                                             image_id=image_id,
-                                             otr_status=otr_status )
-            except hangups.NetworkError as e:
-                logger.exception("CORO_SEND_MESSAGE: error sending {}".format(response[0]))
+        if error is not None:
+            raise error
 
+    @asyncio.coroutine
+    def _send_segments(self, conversation_id, segments, image_id, otr_status):
+        """send a message immediately, use coro_send_message() instead"""
+
+        # send messages using FakeConversation as a workaround
+
+        _fc = FakeConversation(self._client, conversation_id)
+
+        yield from _fc.send_message( segments,
+                                     image_id=image_id,
+                                     otr_status=otr_status )
+
+
+    def _encode_message(self, segments, image_id, otr_status):
+        """json serialisable form of a message for the outbound retry spool"""
+        return { "segments": [ [ segment.text,
+                                 segment.type_.value,
+                                 segment.is_bold,
+                                 segment.is_italic,
+                                 segment.is_strikethrough,
+                                 segment.is_underline,
+                                 segment.link_target ] for segment in segments ],
+                 "image_id": image_id,
+                 "otr_status": None if otr_status is None else otr_status.value }
+
+    def _decode_message(self, message):
+        segments = [ hangups.ChatMessageSegment( text,
+                                                 hangups.SegmentType(type_),
+                                                 is_bold=is_bold,
+                                                 is_italic=is_italic,
+                                                 is_strikethrough=is_strikethrough,
+                                                 is_underline=is_underline,
+                                                 link_target=link_target )
+                     for text, type_, is_bold, is_italic, is_strikethrough, is_underline, link_target
+                     in message["segments"] ]
+        otr_status = message["otr_status"]
+        if otr_status is not None:
+            otr_status = OffTheRecordStatus(otr_status)
+        return segments, message["image_id"], otr_status
 
     @asyncio.coroutine
     def coro_send_to_user(self, chat_id, html, context=None):
@@ -966,7 +1127,9 @@ def main():
     parser.add_argument('--cookies', default=default_cookies_path,
                         help=_('cookie storage path'))
     parser.add_argument('--memory', default=default_memory_path,
-                        help=_('memory storage path'))
+                        help=_('memory storage path, or engine uri e.g. sqlite:///path/to/memory.db, shards:///path/to/memory'))
+    parser.add_argument('--import-memory', default=None,
+                        help=_('import a memory.json into the --memory storage and exit'))
     parser.add_argument('--config', default=default_config_path,
                         help=_('config storage path'))
     parser.add_argument('--retries', default=5, type=int,
@@ -977,8 +1140,10 @@ def main():
 
     
 
+    _memory_engine, memory_path = config.split_storage_uri(args.memory)
+
     # Create all necessary directories.
-    for path in [args.log, args.cookies, args.config, args.memory]:
+    for path in [args.log, args.cookies, args.config, memory_path]:
         directory = os.path.dirname(path)
         if directory and not os.path.isdir(directory):
             try:
@@ -996,6 +1161,13 @@ def main():
 
     configure_logging(args)
 
+    if args.import_memory:
+        try:
+            config.open_storage(args.memory).import_json(args.import_memory)
+        except (OSError, IOError, ValueError) as e:
+            sys.exit(_('Failed to import memory: {}').format(e))
+        sys.exit(0)
+
     # initialise the bot
     bot = HangupsBot(args.cookies, args.config, args.retries, args.memory)
 
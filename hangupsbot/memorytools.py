@@ -0,0 +1,176 @@
+"""memory analysis and pruning
+
+reports the (json) size of memory subtrees and finds data that is no longer needed:
+* users that are not a participant of any known conversation (convmem) and did not send a
+    message for a number of days. the bot records the day of the last message of a user as
+    user_data.<chat_id>._seen, users without one count as last seen on user_seen_since, the
+    day the bot started recording
+* expired invitations and do-not-disturb entries
+* tldr entries of conversations that are no longer known
+
+can be used offline, while the bot is not running:
+    python3 memorytools.py ~/.local/share/hangupsbot/memory.json --days 180
+    python3 memorytools.py ~/.local/share/hangupsbot/memory.json --days 180 --prune
+or through the admin commands memorystats and prunememory. only a dry run is made unless
+pruning is asked for, the memory is then exported to a json backup first (see backup())
+"""
+
+import argparse, datetime, json, logging, os, sys, time
+
+import config
+
+
+logger = logging.getLogger(__name__)
+
+
+# per-user keys that are only a cache of hangups data or activity, other keys are user settings
+user_cache_keys = ("_hangups", "1on1", "_seen")
+
+
+def subtree_sizes(data, depth=1, limit=None):
+    """return [(path, json bytes, number of children)] of the subtrees up to depth, largest first"""
+    sizes = []
+
+    def _walk(node, path):
+        size = len(json.dumps(node, separators=(",", ":")))
+        sizes.append((path, size, len(node) if isinstance(node, (dict, list)) else 0))
+        if isinstance(node, dict) and len(path) < depth:
+            for key, value in node.items():
+                _walk(value, path + [key])
+
+    for key, value in data.items():
+        _walk(value, [key])
+
+    sizes.sort(key=lambda item: item[1], reverse=True)
+    return sizes[:limit] if limit else sizes
+
+
+def _participants(data):
+    participants = set()
+    for conv_id, conv in (data.get("convmem") or {}).items():
+        participants.update(conv.get("participants") or [])
+    return participants
+
+
+def stale_users(data, days, keep_settings=True, keep=()):
+    """return chat ids of users not in any conversation and not seen for days
+    _hangups.updated is not used, it only changes with the profile of a user. users without
+    a known last activity, the bot itself and chat ids in keep are never stale. with
+    keep_settings, users that stored anything besides cached hangups data are kept
+    """
+    participants = _participants(data)
+    threshold = (datetime.date.today() - datetime.timedelta(days=days)).strftime("%Y%m%d")
+    seen_since = data.get("user_seen_since")
+
+    stale = []
+    for chat_id, user in (data.get("user_data") or {}).items():
+        if chat_id in participants or chat_id in keep or not isinstance(user, dict):
+            continue
+
+        _hangups = user.get("_hangups") or {}
+        seen = user.get("_seen") or seen_since
+        if _hangups.get("is_self") or not seen or seen >= threshold:
+            continue
+
+        if keep_settings and any(key not in user_cache_keys for key in user):
+            continue
+
+        stale.append(chat_id)
+
+    return stale
+
+
+def stale_paths(data, days, keep_settings=True, keep=(), now=None):
+    """return [(path, reason)] of everything that can be pruned"""
+    now = now or time.time()
+    paths = []
+
+    for chat_id in stale_users(data, days, keep_settings=keep_settings, keep=keep):
+        paths.append((["user_data", chat_id], "stale user"))
+
+    for invite_id, invite in (data.get("invites") or {}).items():
+        if invite.get("expiry", now) < now:
+            paths.append((["invites", invite_id], "expired invitation"))
+
+    donotdisturb = data.get("donotdisturb")
+    if isinstance(donotdisturb, dict):
+        for chat_id, dnd in donotdisturb.items():
+            if dnd.get("created", now) + dnd.get("expiry", 0) < now:
+                paths.append((["donotdisturb", chat_id], "expired dnd"))
+
+    conversations = data.get("convmem") or {}
+    if conversations:
+        for conv_id in (data.get("tldr") or {}):
+            if conv_id not in conversations:
+                paths.append((["tldr", conv_id], "tldr of unknown conversation"))
+
+    return paths
+
+
+def backup(memory, data=None):
+    """export memory (or data, a copy of it) to <memory file>.<timestamp>.prune.json, which can
+    be restored with Config.import_json(). returns the filename
+    """
+    filename = "{}.{}.prune.json".format(memory.filename.rstrip(os.sep),
+                                         datetime.datetime.now().strftime("%Y%m%d%H%M%S"))
+    config.atomic_write_json(filename, memory.config if data is None else data)
+    return filename
+
+
+def prune(memory, paths, dry_run=True, make_backup=True):
+    """remove paths from a Config, nothing is changed when dry_run is set. with make_backup the
+    memory is exported with backup() before anything is removed
+    returns the number of removed (or removable) paths
+    """
+    paths = [ (path, reason) for path, reason in paths if memory.exists(path) ]
+
+    if paths and not dry_run and make_backup:
+        logger.info("memory saved to {} before pruning".format(backup(memory)))
+
+    for path, reason in paths:
+        logger.info("{}prune {} ({})".format("dry-run: " if dry_run else "", ".".join(path), reason))
+        if not dry_run:
+            memory.pop_by_path(path)
+
+    if paths and not dry_run:
+        memory.save()
+
+    return len(paths)
+
+
+def format_size(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return "{:.1f}{}".format(size, unit)
+        size = size / 1024
+    return "{:.1f}GB".format(size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="analyse and prune bot memory, stop the bot first")
+    parser.add_argument("memory", help="memory file or storage uri, e.g. sqlite:///path/to/memory.db")
+    parser.add_argument("--depth", type=int, default=1, help="report subtrees up to this depth")
+    parser.add_argument("--limit", type=int, default=30, help="number of subtrees to report")
+    parser.add_argument("--days", type=int, default=180, help="users not seen for this many days can be stale")
+    parser.add_argument("--prune-settings", action="store_true", help="also prune stale users with stored settings")
+    parser.add_argument("--prune", action="store_true", help="remove stale data after a json backup, otherwise only report it")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    memory = config.open_storage(args.memory)
+
+    for path, size, children in subtree_sizes(memory.config, depth=args.depth, limit=args.limit):
+        print("{:>10} {:>8} {}".format(format_size(size), children, ".".join(str(key) for key in path)))
+
+    paths = stale_paths(memory.config, args.days, keep_settings=not args.prune_settings)
+    removed = prune(memory, paths, dry_run=not args.prune)
+    if args.prune:
+        memory.flush()
+        print("{} entries pruned".format(removed))
+    else:
+        print("{} entries can be pruned, use --prune to remove them".format(removed))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,614 @@
+"""outbound message scheduling
+
+every message sent by the bot goes through OutboundScheduler.send() or enqueue():
+* messages to a conversation are sent in the order they were queued, one at a time
+* up to concurrency messages to different conversations are sent at the same time
+* token buckets limit the send rate per conversation and in total, so a broadcast or a burst of
+    plugin replies does not get the bot throttled by the server. a rate of 0 disables a limit
+* when several conversations are allowed to send, the message with the highest importance
+    (context["base"]["importance"], see HangupsBot.messagecontext()) goes first, e.g. an
+    @mention alert before relay chatter
+* with a coalesce_window, text messages to the same conversation that are queued within the
+    window are merged into one send, separated by line breaks. messages with an image, with a
+    different otr status or sent with coalesce=False are never merged
+* with a RetryQueue as retry, messages that fail with a temporary error are sent again later,
+    see RetryQueue
+"""
+
+import asyncio, bisect, collections, heapq, itertools, json, logging, os, random, time, uuid
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """allow rate sends per second on average and up to burst at once, rate 0 is unlimited"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now=0):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = self.burst
+        self.updated = now
+
+    def _refill(self, now):
+        if self.rate <= 0:
+            self.tokens = self.burst
+        elif now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now):
+        """seconds until a send is allowed, 0 if it is allowed now"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now):
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class OutboundMessage:
+    __slots__ = ("conv_id", "segments", "image_id", "otr_status", "importance", "sequence",
+                 "queued", "future", "coalesce", "attempt")
+
+    def __init__(self, conv_id, segments, image_id, otr_status, importance, sequence, queued, future,
+                 coalesce, attempt=0):
+        self.conv_id = conv_id
+        self.segments = segments
+        self.image_id = image_id
+        self.otr_status = otr_status
+        self.importance = importance
+        self.sequence = sequence
+        self.queued = queued
+        self.future = future
+        self.coalesce = coalesce and segments and image_id is None
+        self.attempt = attempt # retries so far, future is None for retries
+
+    def length(self):
+        return sum(len(segment.text) for segment in self.segments)
+
+
+class OutboundScheduler:
+    """queue messages per conversation and send them with coroutine
+    send(conv_id, segments, image_id, otr_status), respecting the rate limits
+    """
+
+    def __init__(self, send, rate=1, burst=5, global_rate=5, global_burst=20, concurrency=4,
+                 coalesce_window=0, coalesce_length=2000, separator=None):
+        self._send = send
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = max(1, concurrency)
+        self.coalesce_window = coalesce_window
+        self.coalesce_length = coalesce_length
+        self.separator = separator or [] # segments inserted between merged messages
+
+        self._loop = asyncio.get_event_loop()
+        self._queues = collections.OrderedDict() # conv_id: deque of OutboundMessage
+        self._buckets = {}
+        self._global = TokenBucket(global_rate, global_burst, self._loop.time())
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        self._sending = set() # conversations with a send in progress
+
+        self.retry = None # RetryQueue for failed sends, set by the owner
+
+        self.pending = 0
+        self.sent = 0
+        self.failed = 0
+        self.throttled = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self.latency_last = 0
+        self.latency_max = 0
+        self.latency_total = 0
+
+    def enqueue(self, conv_id, segments, image_id=None, otr_status=None, importance=50, coalesce=True):
+        """queue a message now, returns a future with the result or exception of the send"""
+        future = asyncio.Future()
+        message = OutboundMessage(conv_id, segments, image_id, otr_status, importance or 0,
+                                  next(self._sequence), self._loop.time(), future,
+                                  coalesce and self.coalesce_window > 0)
+        self._queue(message)
+        return future
+
+    @asyncio.coroutine
+    def send(self, conv_id, segments, image_id=None, otr_status=None, importance=50, coalesce=True):
+        """queue a message and wait until it was sent, exceptions of the send are raised here"""
+        return (yield from self.enqueue(conv_id, segments, image_id, otr_status, importance, coalesce))
+
+    def resubmit(self, conv_id, segments, image_id, otr_status, importance, attempt):
+        """queue a retry of a failed message, nobody waits for it"""
+        self._queue(OutboundMessage(conv_id, segments, image_id, otr_status, importance,
+                                    next(self._sequence), self._loop.time(), None, False, attempt))
+
+    def _queue(self, message):
+        conv_id = message.conv_id
+        queue = self._queues.get(conv_id)
+        if queue is None:
+            queue = self._queues[conv_id] = collections.deque()
+        queue.append(message)
+
+        self.pending += 1
+        self.max_depth = max(self.max_depth, len(queue))
+
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.async(self._run())
+        self._wakeup.set()
+
+    def _bucket(self, conv_id, now):
+        bucket = self._buckets.get(conv_id)
+        if bucket is None:
+            if len(self._buckets) > 1000:
+                # forget conversations that are back to their full allowance
+                self._buckets = { key: value for key, value in self._buckets.items()
+                                  if key in self._queues or not value.full(now) }
+            bucket = self._buckets[conv_id] = TokenBucket(self.rate, self.burst, now)
+        return bucket
+
+    def _next(self, now):
+        """return (conv_id, None, False) of the most important sendable message, or
+        (None, seconds to wait, whether a rate limit applies)
+        """
+        best = None
+        best_key = None
+        wait = None
+        limited = False
+        for conv_id, queue in self._queues.items():
+            if conv_id in self._sending:
+                continue
+            delay = self._bucket(conv_id, now).delay(now)
+            if delay:
+                wait = delay if wait is None else min(wait, delay)
+                limited = True
+                continue
+            head = queue[0]
+            if head.coalesce and now < head.queued + self.coalesce_window:
+                # give following messages a chance to be merged
+                delay = head.queued + self.coalesce_window - now
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            key = (head.importance, -head.sequence)
+            if best_key is None or key > best_key:
+                best, best_key = conv_id, key
+        if best is not None:
+            return best, None, False
+        return None, wait, limited
+
+    @asyncio.coroutine
+    def _wait(self, timeout):
+        """sleep until timeout, a new message is queued or a send finished"""
+        self._wakeup.clear()
+        try:
+            yield from asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    @asyncio.coroutine
+    def _run(self):
+        while True:
+            conv_id = messages = None
+            try:
+                if not self._queues or len(self._sending) >= self.concurrency:
+                    yield from self._wait(None)
+                    continue
+
+                now = self._loop.time()
+                delay = self._global.delay(now)
+                if delay:
+                    self.throttled += 1
+                    yield from asyncio.sleep(delay)
+                    continue
+
+                conv_id, wait, limited = self._next(now)
+                if conv_id is None:
+                    if limited:
+                        self.throttled += 1
+                    # wait for tokens, a finished send or a new message
+                    yield from self._wait(wait)
+                    continue
+
+                messages = [ message for message in self._take(conv_id)
+                             if message.future is None or not message.future.cancelled() ]
+                if not messages:
+                    continue
+
+                self._bucket(conv_id, now).take(now)
+                self._global.take(now)
+
+                self._sending.add(conv_id)
+                asyncio.async(self._deliver(messages))
+
+            except Exception as e:
+                # keep the worker alive, the messages it was handling must not wait forever
+                logger.exception("outbound scheduling failed for {}".format(conv_id or "all conversations"))
+                self._fail(conv_id, messages, e)
+
+    def _fail(self, conv_id, messages, error):
+        """fail messages, or the queue of conv_id, or every queue if neither is known"""
+        if messages is None:
+            conv_ids = list(self._queues) if conv_id is None else [ conv_id ]
+            messages = []
+            for key in conv_ids:
+                messages.extend(self._queues.pop(key, ()))
+            self.pending -= len(messages)
+        if conv_id is not None:
+            self._sending.discard(conv_id)
+
+        self.failed += len(messages)
+        for message in messages:
+            if message.future is None:
+                if self.retry is not None:
+                    self.retry.bury(message.conv_id, message.segments, message.image_id,
+                                    message.otr_status, message.importance, message.attempt, error)
+            elif not message.future.done():
+                message.future.set_exception(error)
+
+    def _take(self, conv_id):
+        """remove the head of the conversation queue and the messages that can be merged with it"""
+        queue = self._queues[conv_id]
+        messages = [ queue.popleft() ]
+
+        head = messages[0]
+        if head.coalesce:
+            length = head.length()
+            while queue:
+                candidate = queue[0]
+                if not candidate.coalesce or candidate.otr_status != head.otr_status:
+                    break
+                length += candidate.length()
+                if length > self.coalesce_length:
+                    break
+                messages.append(queue.popleft())
+
+        if not queue:
+            del self._queues[conv_id]
+        self.pending -= len(messages)
+        self.coalesced += len(messages) - 1
+
+        return messages
+
+    @asyncio.coroutine
+    def _deliver(self, messages):
+        head = messages[0]
+        segments = head.segments
+        for message in messages[1:]:
+            segments = segments + self.separator + message.segments
+
+        try:
+            yield from self._send(head.conv_id, segments, head.image_id, head.otr_status)
+        except Exception as e:
+            self.failed += len(messages)
+            error = e
+            if self.retry is not None:
+                if self.retry.attempts > 0 and isinstance(e, self.retry.retryable):
+                    # merged messages are retried as one, their callers carry on
+                    self.retry.add(head.conv_id, segments, head.image_id, head.otr_status,
+                                   head.importance, head.attempt + 1, e)
+                    error = None
+                elif head.future is None:
+                    self.retry.bury(head.conv_id, segments, head.image_id, head.otr_status,
+                                    head.importance, head.attempt, e)
+            for message in messages:
+                if message.future is None or message.future.done():
+                    continue
+                if error is None:
+                    message.future.set_result(None)
+                else:
+                    message.future.set_exception(error)
+            return
+        finally:
+            self._sending.discard(head.conv_id)
+            self._wakeup.set()
+
+        now = self._loop.time()
+        for message in messages:
+            self.sent += 1
+            latency = now - message.queued
+            self.latency_last = latency
+            self.latency_max = max(self.latency_max, latency)
+            self.latency_total += latency
+
+            if message.future is not None and not message.future.done():
+                message.future.set_result(None)
+
+    def stats(self):
+        depths = [ len(queue) for queue in self._queues.values() ]
+        return { "pending": self.pending,
+                 "conversations": len(depths),
+                 "deepest": max(depths) if depths else 0,
+                 "sending": len(self._sending),
+                 "sent": self.sent,
+                 "failed": self.failed,
+                 "throttled": self.throttled,
+                 "coalesced": self.coalesced,
+                 "max depth": self.max_depth,
+                 "latency.last": self.latency_last,
+                 "latency.max": self.latency_max,
+                 "latency.average": self.latency_total / self.sent if self.sent else 0 }
+
+
+class RetryQueue:
+    """retry messages whose send failed with one of the retryable exceptions
+
+    * retry n of a message is sent min(max_delay, delay * 2 ** (n - 1)) seconds after the
+        failure, randomised by +-50% so that messages which failed together are not retried
+        together. retries go through the scheduler again with resend(conv_id, segments,
+        image_id, otr_status, importance, attempt), after messages that were sent meanwhile
+    * every message is written to its own json file in spool_dir when it is queued, so it
+        survives a crash or restart: load() picks the files up at the next start. up to memory
+        messages are also kept in memory, further ones are read back from their file when due
+    * attempts = 0 disables retries, the error is raised to the sender as without a RetryQueue
+    * messages that still fail after attempts retries or fail with another error when they are
+        retried become dead letters: the last dead_letters of them are kept in
+        spool_dir/dead-letters.json and can be replayed
+    * messages are stored as encode(segments, image_id, otr_status), which must return json
+        serialisable data, and restored with decode(data) -> (segments, image_id, otr_status)
+    """
+
+    def __init__(self, resend, encode, decode, spool_dir, retryable=(), attempts=5, delay=2,
+                 max_delay=300, memory=100, dead_letters=100):
+        self._resend = resend
+        self._encode = encode
+        self._decode = decode
+        self.spool_dir = spool_dir
+        self.retryable = tuple(retryable)
+        self.attempts = attempts
+        self.delay = delay
+        self.max_delay = max_delay
+        self.memory = memory
+        self.max_dead_letters = dead_letters
+
+        self._waiting = [] # heap of (due, sequence, entry, spool file name or None)
+        self._spool = [] # sorted file names in spool_dir, they start with the due time
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._worker = None
+
+        self.dead_letters = []
+
+        self.retried = 0
+        self.resent = 0
+        self.spilled = 0
+        self.buried = 0
+        self.replayed = 0
+
+    def backoff(self, attempt):
+        """seconds to wait before retry attempt"""
+        delay = min(self.max_delay, self.delay * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.5)
+
+    def _entry(self, conv_id, segments, image_id, otr_status, importance, attempt, error):
+        return { "conv_id": conv_id,
+                 "message": self._encode(segments, image_id, otr_status),
+                 "text": "".join(segment.text for segment in segments)[:100],
+                 "importance": importance,
+                 "attempt": attempt,
+                 "error": "{}: {}".format(type(error).__name__, error),
+                 "due": 0 }
+
+    def add(self, conv_id, segments, image_id, otr_status, importance, attempt, error):
+        """schedule retry attempt of a message that failed with error"""
+        entry = self._entry(conv_id, segments, image_id, otr_status, importance, attempt, error)
+        if attempt > self.attempts:
+            entry["attempt"] = attempt - 1 # retries made
+            self._bury(entry)
+            return
+
+        delay = self.backoff(attempt)
+        entry["due"] = time.time() + delay
+        logger.warning("send to {} failed ({}), retry {} of {} in {:.1f}s".format(
+            conv_id, entry["error"], attempt, self.attempts, delay))
+
+        self.retried += 1
+        name = self._spool_write(entry)
+        if len(self._waiting) < self.memory or name is None:
+            heapq.heappush(self._waiting, (entry["due"], next(self._sequence), entry, name))
+        else:
+            bisect.insort(self._spool, name)
+            self.spilled += 1
+
+        self._start()
+
+    def bury(self, conv_id, segments, image_id, otr_status, importance, attempt, error):
+        """make a message that can not be retried a dead letter"""
+        self._bury(self._entry(conv_id, segments, image_id, otr_status, importance, attempt, error))
+
+    def _bury(self, entry):
+        logger.error("giving up on message to {} after {} retries: {}".format(
+            entry["conv_id"], entry["attempt"], entry["error"]))
+        entry["due"] = time.time()
+        self.dead_letters.append(entry)
+        self.dead_letters = self._newest_dead_letters(self.dead_letters)
+        self.buried += 1
+        self._save_dead_letters()
+
+    def _newest_dead_letters(self, dead_letters):
+        if self.max_dead_letters <= 0:
+            return []
+        return dead_letters[-self.max_dead_letters:]
+
+    def replay(self, indices=None):
+        """resend the dead letters at indices (all if None) with a fresh retry count, return
+        the number of replayed messages
+        """
+        if indices is None:
+            indices = range(len(self.dead_letters))
+        indices = set(index for index in indices if 0 <= index < len(self.dead_letters))
+
+        replay = [ entry for index, entry in enumerate(self.dead_letters) if index in indices ]
+        self.dead_letters = [ entry for index, entry in enumerate(self.dead_letters)
+                              if index not in indices ]
+        self._save_dead_letters()
+
+        for entry in replay:
+            entry["attempt"] = 0
+            self._send(entry)
+        self.replayed += len(replay)
+        return len(replay)
+
+    def clear_dead_letters(self):
+        count = len(self.dead_letters)
+        self.dead_letters = []
+        self._save_dead_letters()
+        return count
+
+    def _send(self, entry):
+        try:
+            segments, image_id, otr_status = self._decode(entry["message"])
+        except Exception as e:
+            entry["error"] = "{}: {}".format(type(e).__name__, e)
+            self._bury(entry)
+            return
+        self._resend(entry["conv_id"], segments, image_id, otr_status, entry["importance"],
+                     entry["attempt"])
+
+    def _start(self):
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.async(self._run())
+        self._wakeup.set()
+
+    @asyncio.coroutine
+    def _run(self):
+        while self._waiting or self._spool:
+            due = min(self._waiting[0][0] if self._waiting else float("inf"),
+                      self._spool_due(self._spool[0]) if self._spool else float("inf"))
+            delay = due - time.time()
+            if delay > 0:
+                # sleep until the next retry is due or an earlier one is added
+                self._wakeup.clear()
+                try:
+                    yield from asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            if self._waiting and self._waiting[0][0] <= due:
+                entry, name = heapq.heappop(self._waiting)[2:]
+                if name is not None:
+                    self._spool_remove(name)
+            else:
+                entry = self._unspill(self._spool.pop(0))
+                if entry is None:
+                    continue
+
+            self.resent += 1
+            self._send(entry)
+
+    def _spool_due(self, name):
+        return int(name.split("-", 1)[0]) / 1000
+
+    def _spool_write(self, entry):
+        """write entry to the spool, return its file name or None if that failed"""
+        name = "{:015d}-{}.json".format(int(entry["due"] * 1000), uuid.uuid4().hex)
+        try:
+            _write_json(os.path.join(self.spool_dir, name), entry)
+        except (OSError, IOError, ValueError):
+            logger.exception("failed to spool message to {}".format(entry["conv_id"]))
+            return None
+        return name
+
+    def _spool_remove(self, name):
+        try:
+            os.remove(os.path.join(self.spool_dir, name))
+        except OSError:
+            pass
+
+    def _unspill(self, name):
+        path = os.path.join(self.spool_dir, name)
+        try:
+            with open(path) as file:
+                entry = json.load(file)
+            os.remove(path)
+        except (OSError, IOError, ValueError):
+            logger.exception("failed to read spooled message {}".format(path))
+            return None
+        return entry
+
+    def load(self):
+        """pick up the spooled messages and dead letters of a previous run"""
+        try:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            names = os.listdir(self.spool_dir)
+        except OSError:
+            logger.exception("failed to open the outbound spool {}".format(self.spool_dir))
+            return
+
+        spooled = [ name for name in names
+                    if name.endswith(".json") and name.split("-", 1)[0].isdigit() ]
+        self._spool = sorted(set(self._spool).union(spooled))
+
+        path = os.path.join(self.spool_dir, "dead-letters.json")
+        if os.path.isfile(path):
+            try:
+                with open(path) as file:
+                    self.dead_letters = self._newest_dead_letters(json.load(file))
+            except (OSError, IOError, ValueError):
+                logger.exception("failed to read {}".format(path))
+
+        if self._spool:
+            logger.info("{} spooled messages to retry".format(len(self._spool)))
+            self._start()
+
+    def flush(self):
+        """drop the messages waiting in memory, they are already spooled and picked up by load().
+        messages that could not be spooled are written again
+        """
+        while self._waiting:
+            entry, name = heapq.heappop(self._waiting)[2:]
+            if name is None:
+                name = self._spool_write(entry)
+                if name is None:
+                    logger.error("message to {} lost".format(entry["conv_id"]))
+                    continue
+            bisect.insort(self._spool, name)
+
+    def _save_dead_letters(self):
+        path = os.path.join(self.spool_dir, "dead-letters.json")
+        try:
+            _write_json(path, self.dead_letters)
+        except (OSError, IOError, ValueError):
+            logger.exception("failed to write {}".format(path))
+
+    def stats(self):
+        return { "waiting": len(self._waiting) + len(self._spool),
+                 "spooled": len(self._spool),
+                 "retried": self.retried,
+                 "resent": self.resent,
+                 "spilled": self.spilled,
+                 "dead letters": len(self.dead_letters),
+                 "buried": self.buried,
+                 "replayed": self.replayed }
+
+
+def _write_json(path, data):
+    """write data atomically and durably, so a crash does not leave half a file behind or
+    lose it. the directory is synced as well, it holds the new file name
+    """
+    temporary = path + ".tmp"
+    with open(temporary, "w") as file:
+        json.dump(data, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+    try:
+        directory = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    except OSError:
+        # e.g. windows, where directories can not be opened
+        return
+    try:
+        os.fsync(directory)
+    except OSError:
+        pass
+    finally:
+        os.close(directory)
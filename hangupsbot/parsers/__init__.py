@@ -1,23 +1,267 @@
 """file imported by utils.py
 more parsers and parser utility functions can be imported here
 """
+import collections, re, string
+
 import hangups
 
 import parsers.kludgy_html_parser
 
 from parsers.kludgy_html_parser import segment_to_html
 
-def simple_parse_to_segments(formatted_text):
-    """send formatted chat message
-    legacy notice: identical function in kludgy_html_parser
-    the older function is "overridden" here for compatibility reasons
+
+class ParseCache:
+    """least recently used cache of parse results, keyed on the exact html string
+
+    cached results are shared by everyone who parsed the same html and must not be modified.
+    html longer than max_length is parsed every time, long messages rarely repeat
     """
+
+    def __init__(self, maxsize=500, max_length=2000):
+        self.maxsize = maxsize
+        self.max_length = max_length
+        self._entries = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.uncached = 0
+        self.evicted = 0
+
+    def get(self, html, parse):
+        """return parse(html), from the cache if html was parsed before"""
+        if self.maxsize <= 0 or len(html) > self.max_length:
+            self.uncached += 1
+            return parse(html)
+
+        try:
+            result = self._entries[html]
+        except KeyError:
+            self.misses += 1
+            result = self._entries[html] = parse(html)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evicted += 1
+        else:
+            self.hits += 1
+            self._entries.move_to_end(html)
+        return result
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return { "hits": self.hits,
+                 "misses": self.misses,
+                 "uncached": self.uncached,
+                 "evicted": self.evicted,
+                 "hit rate": self.hits / lookups if lookups else 0,
+                 "cached": len(self._entries) }
+
+
+segment_cache = ParseCache()
+
+template_cache = ParseCache(maxsize=100, max_length=10000)
+
+
+def _parse_to_segments(formatted_text):
     if "message_parser" in dir(hangups):
         # ReParser is available in hangups 201504200224 (ae59c24) onwards
         # supports html, markdown
-        segments = hangups.ChatMessageSegment.from_str(formatted_text)
+        return hangups.ChatMessageSegment.from_str(formatted_text)
     else:
         # fallback to internal parser
         # supports html
-        segments = kludgy_html_parser.simple_parse_to_segments(formatted_text)
-    return segments
\ No newline at end of file
+        return kludgy_html_parser.simple_parse_to_segments(formatted_text)
+
+
+def simple_parse_to_segments(formatted_text):
+    """send formatted chat message
+    legacy notice: identical function in kludgy_html_parser
+    the older function is "overridden" here for compatibility reasons
+
+    repeated html is served from segment_cache. the list is new for every call, the segments
+        in it are shared and must not be modified
+    """
+    return list(segment_cache.get(formatted_text, _parse_to_segments))
+
+
+# placeholder for the nth template field while the template is parsed, from the unicode
+#   private use area so it does not clash with html, markdown or urls
+_marker = re.compile("\ue000([0-9]+)\ue001")
+
+# (parse, url regex, link target function) for the parsers _parse_to_segments() can use. urls
+#   in values are linked like the parser links urls: the fallback parser links what fix_urls()
+#   links, ChatMessageParser auto-links with the regex and completion of hangups.message_parser
+_parsers = { "fallback": ( kludgy_html_parser.simple_parse_to_segments,
+                           re.compile(r"https?://[^\s)>\]!*<]+"),
+                           None ) }
+
+if "message_parser" in dir(hangups):
+    _parsers["hangups"] = ( hangups.ChatMessageSegment.from_str,
+                            re.compile(hangups.message_parser.auto_link),
+                            hangups.message_parser.url_complete )
+    _parser = "hangups"
+else:
+    _parser = "fallback"
+
+
+class SegmentTemplate:
+    """html with str.format() fields, parsed once
+
+    render() fills the fields in as plain text, like the template formatted with html-escaped
+    values and parsed: markup in values is not interpreted, urls in values become links the way
+    the parser links them and line breaks in values become line break segments. unlike parsing,
+    whitespace in values is kept as it is and a url at the edge of a value is linked even if it
+    touches a tag
+
+    parser is "hangups" or "fallback", the parser _parse_to_segments() uses by default
+    """
+
+    _formatter = string.Formatter()
+
+    def __init__(self, html, parser=None):
+        parse, self._url, self._url_target = _parsers[parser or _parser]
+
+        self._fields = [] # (field_name, conversion, format_spec)
+
+        marked = []
+        auto_number = 0
+        for literal, field_name, format_spec, conversion in self._formatter.parse(html):
+            marked.append(literal)
+            if field_name is None:
+                continue
+            if field_name == "" or field_name[0] in ".[":
+                field_name = str(auto_number) + field_name
+                auto_number += 1
+            marked.append("\ue000{}\ue001".format(len(self._fields)))
+            self._fields.append((field_name, conversion, format_spec))
+
+        # segments without fields are built once and shared by all renderings
+        self._segments = [] # (shared segment or None, text parts, type, formatting, link target parts)
+        for segment in parse("".join(marked)):
+            text = self._split(segment.text)
+            link_target = self._split(segment.link_target)
+            if len(text) == 1 and len(link_target) == 1:
+                static = segment
+                if segment.type_ == hangups.SegmentType.TEXT and "\n" in segment.text:
+                    static = None
+            else:
+                static = None
+            self._segments.append(( static, text, segment.type_, segment.is_bold, segment.is_italic,
+                                    segment.is_strikethrough, segment.is_underline, link_target ))
+
+    def _split(self, text):
+        """(literal, field index, literal, ...) for text with markers"""
+        if not text:
+            return (text,)
+        parts = _marker.split(text)
+        parts[1::2] = [ int(index) for index in parts[1::2] ]
+        return tuple(parts)
+
+    def _join(self, parts, values):
+        if len(parts) == 1:
+            return parts[0]
+        if len(parts) == 3 and not parts[0] and not parts[2]:
+            return values[parts[1]]
+        return "".join(values[part] if i % 2 else part for i, part in enumerate(parts))
+
+    def _values(self, args, kwargs):
+        values = []
+        for field_name, conversion, format_spec in self._fields:
+            if not conversion and not format_spec:
+                # fast path for plain {}, {0} and {name}
+                if field_name.isdigit():
+                    value = args[int(field_name)]
+                    values.append(value if type(value) is str else format(value))
+                    continue
+                if field_name.isidentifier():
+                    value = kwargs[field_name]
+                    values.append(value if type(value) is str else format(value))
+                    continue
+            value = self._formatter.get_field(field_name, args, kwargs)[0]
+            value = self._formatter.convert_field(value, conversion)
+            if "{" in format_spec:
+                format_spec = self._formatter.vformat(format_spec, args, kwargs)
+            values.append(self._formatter.format_field(value, format_spec))
+        return values
+
+    def _pieces(self, parts, values):
+        """[(text, url or None)] for a text segment, urls in values become links"""
+        pieces = []
+        for i, part in enumerate(parts):
+            if i % 2:
+                part = values[part]
+                if "/" in part or "." in part:
+                    start = 0
+                    for match in self._url.finditer(part):
+                        if match.start() > start:
+                            self._append_text(pieces, part[start:match.start()])
+                        url = match.group(0)
+                        pieces.append((url, self._url_target(url) if self._url_target else url))
+                        start = match.end()
+                    part = part[start:]
+            if part:
+                self._append_text(pieces, part)
+        return pieces
+
+    def _append_text(self, pieces, text):
+        if pieces and pieces[-1][1] is None:
+            pieces[-1] = (pieces[-1][0] + text, None)
+        else:
+            pieces.append((text, None))
+
+    def render(self, *args, **kwargs):
+        """return a new list of segments with the fields filled in, segments without fields
+        are shared and must not be modified
+        """
+        values = self._values(args, kwargs)
+
+        segments = []
+        for static, text, type_, is_bold, is_italic, is_strikethrough, is_underline, link_target in self._segments:
+            if static is not None:
+                segments.append(static)
+                continue
+
+            link_target = self._join(link_target, values)
+
+            if type_ != hangups.SegmentType.TEXT:
+                text = self._join(text, values)
+                if text:
+                    segments.append(hangups.ChatMessageSegment( text,
+                                                                type_,
+                                                                is_bold=is_bold,
+                                                                is_italic=is_italic,
+                                                                is_strikethrough=is_strikethrough,
+                                                                is_underline=is_underline,
+                                                                link_target=link_target ))
+                continue
+
+            for text, url in self._pieces(text, values):
+                if url is not None:
+                    segments.append(hangups.ChatMessageSegment( text,
+                                                                hangups.SegmentType.LINK,
+                                                                is_bold=is_bold,
+                                                                is_italic=is_italic,
+                                                                is_strikethrough=is_strikethrough,
+                                                                is_underline=is_underline,
+                                                                link_target=url ))
+                    continue
+
+                for i, line in enumerate(text.split("\n")):
+                    if i:
+                        segments.append(hangups.ChatMessageSegment("\n", hangups.SegmentType.LINE_BREAK))
+                    if line:
+                        segments.append(hangups.ChatMessageSegment( line,
+                                                                    type_,
+                                                                    is_bold=is_bold,
+                                                                    is_italic=is_italic,
+                                                                    is_strikethrough=is_strikethrough,
+                                                                    is_underline=is_underline,
+                                                                    link_target=link_target ))
+        return segments
+
+
+def compile_template(html):
+    """return the SegmentTemplate for html, compiled templates are kept in template_cache"""
+    return template_cache.get(html, SegmentTemplate)
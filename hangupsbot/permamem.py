@@ -82,6 +82,11 @@ class conversation_memory:
             self.bot.memory.set_by_path(['convmem'], {})
             memory_updated = True
 
+        if not self.bot.memory.exists(['user_seen_since']):
+            # users without a "_seen" day were not active since activity tracking started
+            self.bot.memory.set_by_path(['user_seen_since'], datetime.date.today().strftime("%Y%m%d"))
+            memory_updated = True
+
         convs = self.bot.memory.get_by_path(['convmem'])
         for conv_id in convs:
             conv = convs[conv_id]
@@ -331,6 +336,19 @@ class conversation_memory:
         return changed
 
 
+    def mark_seen(self, chat_id):
+        """record the day (YYYYMMDD) a user was last active as user_data.<chat_id>._seen
+        written at most once a day per user, memorytools uses it to find stale users
+        """
+        today = datetime.date.today().strftime("%Y%m%d")
+        if self.bot.memory.path("user_data", "*", "_seen").get(chat_id) == today:
+            return
+        if not isinstance(self.bot.memory.path("user_data", "*").get(chat_id), dict):
+            return
+
+        self.bot.memory.set_by_path(["user_data", chat_id, "_seen"], today)
+        self.bot.memory.save()
+
     @asyncio.coroutine
     def update(self, conv, source="unknown", automatic_save=True):
         """update conversation memory based on supplied hangups Conversation
@@ -164,10 +164,14 @@ def register_admin_command(command_names, tags=None):
         command_names = [command_names]
     tracking.register_command("admin", command_names, tags=tags)
 
-def register_handler(function, type="message", priority=50):
-    """register external handler"""
+def register_handler(function, type="message", priority=50, concurrent=False, filters=None):
+    """register external handler
+    concurrent = True marks a coroutine handler as safe to run alongside other handlers
+    of the same priority, see handlers.EventHandler.run_pluggable_bands()
+    filters = { "regex": ..., "from_bot": False, ... } lets the dispatcher skip the handler
+    for events that do not match, see handlers.HandlerFilter"""
     bot_handlers = tracking.bot._handlers
-    bot_handlers.register_handler(function, type, priority)
+    bot_handlers.register_handler(function, type, priority, concurrent=concurrent, filters=filters)
 
 def register_shared(id, objectref, forgiving=True):
     """register shared object"""
@@ -463,6 +467,8 @@ def unload(bot, module_path):
                         logger.debug("deregistering tagged command {}".format(command_name))
                         del command.command_tagsets[command_name]
 
+            command.invalidate_permissions()
+
             for type in bot._handlers.pluggables:
                 for handler in bot._handlers.pluggables[type]:
                     if handler[2]["module.path"] == module_path:
@@ -9,16 +9,13 @@ logger = logging.getLogger(__name__)
 
 
 def _initialise():
-    plugins.register_handler(_handle_forwarding, type="message")
+    plugins.register_handler(_handle_forwarding, type="message",
+                             filters={ "config": "forwarding_enabled" })
 
 
 @asyncio.coroutine
 def _handle_forwarding(bot, event, command):
-    """Handle message forwarding"""
-    # Test if message forwarding is enabled
-    if not bot.get_config_suboption(event.conv_id, 'forwarding_enabled'):
-        return
-
+    """Handle message forwarding, only called if forwarding_enabled is set"""
     forward_to_list = bot.get_config_suboption(event.conv_id, 'forward_to')
     if forward_to_list:
         logger.debug("{}".format(forward_to_list))
@@ -4,6 +4,7 @@ from pushbullet import PushBullet
 
 import plugins
 
+from parsers import compile_template
 from utils import remove_accents
 
 
@@ -114,7 +115,7 @@ def mention(bot, event, *args):
                 if noisy_mention_test or bot.get_config_suboption(event.conv_id, 'mentionerrors'):
                     yield from bot.coro_send_message(
                         event.conv,
-                        _("<b>{}</b>, you cannot @mention anyone until your DND status is toggled off.").format(
+                        compile_template(_("<b>{}</b>, you cannot @mention anyone until your DND status is toggled off.")).render(
                             event.user.full_name))
                 return
             else:
@@ -124,7 +125,7 @@ def mention(bot, event, *args):
             if noisy_mention_test or bot.get_config_suboption(event.conv_id, 'mentionerrors'):
                 yield from bot.coro_send_message(
                     event.conv,
-                    _("<b>{}</b> cannot @mention anyone until they say something to me first.").format(
+                    compile_template(_("<b>{}</b> cannot @mention anyone until they say something to me first.")).render(
                         event.user.full_name))
             return
 
@@ -165,12 +166,12 @@ def mention(bot, event, *args):
                     if conv_1on1_initiator:
                         yield from bot.coro_send_message(
                             conv_1on1_initiator,
-                            _("You are not allowed to mention all users in <b>{}</b>").format(
+                            compile_template(_("You are not allowed to mention all users in <b>{}</b>")).render(
                                 conversation_name))
                     if noisy_mention_test or bot.get_config_suboption(event.conv_id, 'mentionerrors'):
                         yield from bot.coro_send_message(
                             event.conv,
-                            _("<b>{}</b> blocked from mentioning all users").format(
+                            compile_template(_("<b>{}</b> blocked from mentioning all users")).render(
                                 event.user.full_name))
                     return
                 else:
@@ -184,14 +185,15 @@ def mention(bot, event, *args):
     exact_nickname_matches = []
     exact_fragment_matches = []
     mention_list = []
+    nicknames = bot.memory.path("user_data", "*", "nickname").get_many([ u.id_.chat_id for u in users_in_chat ])
     for u in users_in_chat:
 
         # mentions also checks nicknames if one is configured
         #  exact matches only! see following IF block
         nickname = ""
         nickname_lower = ""
-        if bot.memory.exists(['user_data', u.id_.chat_id, "nickname"]):
-            nickname = bot.memory.get_by_path(['user_data', u.id_.chat_id, "nickname"])
+        if nicknames[u.id_.chat_id] is not None:
+            nickname = nicknames[u.id_.chat_id]
             nickname_lower = nickname.lower()
 
         _normalised_full_name_upper = remove_accents(u.full_name.upper())
@@ -335,10 +337,11 @@ def mention(bot, event, *args):
                 if conv_1on1:
                     yield from bot.coro_send_message(
                         conv_1on1,
-                        message_mentioned.format(
+                        compile_template(message_mentioned).render(
                             source_name,
                             conversation_name,
-                            event.text)) # prevent internal parser from removing <tags>
+                            event.text), # <tags> in the text are kept, urls are linked
+                        context={ "base": bot.messagecontext("mentions", 80, ["alert"]) })
                     mention_chat_ids.append(u.id_.chat_id)
                     user_tracking["mentioned"].append(u.full_name)
                     logger.info("{} ({}) alerted via 1on1 ({})".format(u.full_name, u.id_.chat_id, conv_1on1.id_))
@@ -89,11 +89,8 @@ def _populate_keywords(bot, event):
     # Pull the keywords from file if not already
     if not _internal.keywords:
         bot.initialise_memory(event.user.id_.chat_id, "user_data")
-        for userchatid in bot.memory.get_option("user_data"):
-            userkeywords = []
-            if bot.memory.exists(["user_data", userchatid, "keywords"]):
-                userkeywords = bot.memory.get_by_path(["user_data", userchatid, "keywords"])
-
+        all_keywords = bot.memory.path("user_data", "*", "keywords").get_many(bot.memory.get_option("user_data"))
+        for userchatid, userkeywords in all_keywords.items():
             if userkeywords:
                 _internal.keywords[userchatid] = userkeywords
             else:
@@ -27,7 +27,8 @@ def prettydate(diff):
 
 def _initialise(bot):
   plugins.register_admin_command(["twitterkey", "twittersecret", 'twitterconfig'])
-  plugins.register_handler(_watch_twitter_link, type="message")
+  plugins.register_handler(_watch_twitter_link, type="message", concurrent=True,
+                           filters={ "regex": "twitter.com/" })
 
 def twittersecret(bot, event, secret):
   '''Set your Twitter API Secret. Get one from https://apps.twitter.com/app'''
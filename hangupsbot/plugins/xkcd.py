@@ -15,7 +15,8 @@ _cache = {}
 
 def _initialise():
     plugins.register_user_command(["xkcd"])
-    plugins.register_handler(_watch_xkcd_link, type="message")
+    plugins.register_handler(_watch_xkcd_link, type="message", concurrent=True,
+                             filters={ "regex": "|".join(regexps) })
 
 regexps = (
     "https?://(?:www\.)?(?:explain)?xkcd.com/([0-9]+)(?:/|\s|$)",
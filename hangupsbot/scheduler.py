@@ -0,0 +1,240 @@
+import asyncio, collections, logging, time
+
+
+logger = logging.getLogger(__name__)
+
+
+class EventScheduler:
+    """dispatch events in order per conversation with a bounded number of workers
+
+    every conversation has its own FIFO queue: events of a conversation are handled one after
+    the other, different conversations are handled in parallel by up to workers at a time
+
+    an event that takes longer than release_after seconds (e.g. a command that sleeps) keeps
+        running in the background, but stops holding up its conversation and its worker
+
+    when events pile up, low-value events (shed_types) are dropped once their conversation
+        queue is shed_depth deep or max_pending events are waiting. other events are never
+        dropped, put() waits for the queues to drain instead (backpressure)
+    """
+
+    def __init__(self, workers=16, max_pending=1000, shed_depth=20, release_after=5,
+                 shed_types=("typing", "watermark")):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.shed_depth = shed_depth
+        self.release_after = release_after
+        self.shed_types = shed_types
+
+        self._queues = {}
+        self._ready = collections.deque()
+        self._running = 0
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+
+        self.pending = 0
+        self.dispatched = 0
+        self.shed = 0
+        self.released = 0
+        self.waits = 0
+        self.max_depth = 0
+        self.max_pending_seen = 0
+        self.max_wait = 0
+
+    def submit(self, conv_id, kind, function, *args):
+        """queue coroutine function(*args) for conv_id, returns False if the event was shed"""
+        queue = self._queues.get(conv_id)
+        depth = len(queue) if queue is not None else 0
+
+        if kind in self.shed_types and (depth >= self.shed_depth or self.pending >= self.max_pending):
+            self.shed += 1
+            return False
+
+        if queue is None:
+            queue = self._queues[conv_id] = collections.deque()
+            self._ready.append(conv_id)
+        queue.append((kind, function, args, time.time()))
+
+        self.pending += 1
+        self.max_depth = max(self.max_depth, depth + 1)
+        self.max_pending_seen = max(self.max_pending_seen, self.pending)
+
+        if self.pending >= self.max_pending:
+            self._not_full.clear()
+
+        if self._ready and self._running < self.workers:
+            self._running += 1
+            asyncio.async(self._worker())
+
+        return True
+
+    @asyncio.coroutine
+    def put(self, conv_id, kind, function, *args):
+        """submit(), but wait while max_pending events are queued, unless kind can be shed"""
+        if kind not in self.shed_types and self.pending >= self.max_pending:
+            self.waits += 1
+            logger.warning("{} events pending, waiting".format(self.pending))
+            while self.pending >= self.max_pending:
+                yield from self._not_full.wait()
+
+        return self.submit(conv_id, kind, function, *args)
+
+    @asyncio.coroutine
+    def _worker(self):
+        try:
+            while self._ready:
+                conv_id = self._ready.popleft()
+                queue = self._queues[conv_id]
+                kind, function, args, queued = queue.popleft()
+
+                self.pending -= 1
+                if self.pending < self.max_pending:
+                    self._not_full.set()
+
+                yield from self._run(conv_id, kind, function, args, queued)
+
+                # round robin: the conversation goes to the back of the line
+                if queue:
+                    self._ready.append(conv_id)
+                else:
+                    del self._queues[conv_id]
+        finally:
+            self._running -= 1
+
+    @asyncio.coroutine
+    def _run(self, conv_id, kind, function, args, queued):
+        self.dispatched += 1
+        self.max_wait = max(self.max_wait, time.time() - queued)
+
+        task = asyncio.async(function(*args))
+        task.add_done_callback(lambda future: self._done(conv_id, kind, future))
+
+        done, pending = yield from asyncio.wait([ task ], timeout=self.release_after)
+        if pending:
+            self.released += 1
+            logger.debug("{} event in {} still running after {}s, releasing queue".format(
+                kind, conv_id, self.release_after))
+
+    def _done(self, conv_id, kind, future):
+        if future.cancelled():
+            return
+        exception = future.exception()
+        if exception is not None:
+            logger.error("{} event in {} failed".format(kind, conv_id),
+                         exc_info=(type(exception), exception, exception.__traceback__))
+
+    def stats(self):
+        depths = [ len(queue) for queue in self._queues.values() ]
+        return { "pending": self.pending,
+                 "conversations": len(depths),
+                 "deepest": max(depths) if depths else 0,
+                 "workers": self._running,
+                 "dispatched": self.dispatched,
+                 "shed": self.shed,
+                 "released": self.released,
+                 "waits": self.waits,
+                 "max depth": self.max_depth,
+                 "max pending": self.max_pending_seen,
+                 "max wait": self.max_wait }
+
+
+class StatusCoalescer:
+    """collapse status notifications per (kind, conversation, user) within window seconds
+
+    the first notification of a key is passed to deliver(kind, notification) immediately and
+        starts the window. later ones within the window replace each other: only the latest
+        state is delivered when the window closes. with a window of 0 (the default) every
+        notification is delivered immediately
+    """
+
+    def __init__(self, deliver, window=0):
+        self.deliver = deliver
+        self.window = window
+
+        self._latest = {}
+
+        self.received = 0
+        self.delivered = 0
+
+    def add(self, kind, conv_id, user_key, notification):
+        self.received += 1
+
+        if self.window <= 0:
+            self._deliver(kind, notification)
+            return
+
+        key = (kind, conv_id, user_key)
+        if key not in self._latest:
+            # None marks an open window without a pending notification
+            self._latest[key] = None
+            asyncio.get_event_loop().call_later(self.window, self._flush, key)
+            self._deliver(kind, notification)
+            return
+        self._latest[key] = notification
+
+    def _flush(self, key):
+        notification = self._latest.pop(key, None)
+        if notification is not None:
+            self._deliver(key[0], notification)
+
+    def _deliver(self, kind, notification):
+        self.delivered += 1
+        try:
+            self.deliver(kind, notification)
+        except Exception:
+            logger.exception("{} notification could not be delivered".format(kind))
+
+    def stats(self):
+        waiting = sum(1 for notification in self._latest.values() if notification is not None)
+        return { "received": self.received,
+                 "delivered": self.delivered,
+                 "coalesced": self.received - self.delivered - waiting,
+                 "waiting": waiting }
+
+
+class DuplicateFilter:
+    """remember event ids for ttl seconds to drop events that are delivered twice
+
+    ids are kept in arrival order, so expired ids are always at the head: checking, adding and
+        expiring are amortised O(1). at most maxlen ids are remembered
+    """
+
+    def __init__(self, ttl=3, maxlen=10000):
+        self.ttl = ttl
+        self.maxlen = maxlen
+
+        self._seen = collections.OrderedDict()
+
+        self.checked = 0
+        self.duplicates = 0
+        self.evicted = 0
+
+    def is_duplicate(self, event_id, now=None):
+        """return True if event_id was seen within ttl seconds, otherwise remember it"""
+        now = now or time.time()
+        self.checked += 1
+
+        seen = self._seen
+        threshold = now - self.ttl
+        while seen:
+            oldest = next(iter(seen))
+            if seen[oldest] > threshold:
+                break
+            del seen[oldest]
+
+        if event_id in seen:
+            self.duplicates += 1
+            return True
+
+        seen[event_id] = now
+        if len(seen) > self.maxlen:
+            seen.popitem(last=False)
+            self.evicted += 1
+
+        return False
+
+    def stats(self):
+        return { "checked": self.checked,
+                 "duplicates": self.duplicates,
+                 "evicted": self.evicted,
+                 "remembered": len(self._seen) }
@@ -1,10 +1,13 @@
-import logging, re
+import itertools, logging, re
 
 from commands import command
 
 
 logger = logging.getLogger(__name__)
 
+# shared by all instances, a tags instance built on reconnect never reuses a generation
+_generations = itertools.count(1)
+
 
 class tags:
     regex_allowed = "a-z0-9._\-" # +command.deny_prefix
@@ -16,6 +19,7 @@ class tags:
 
     bot = None
     indices = {}
+    generation = 0 # changes with the indices, see commands.get_available_commands()
 
     def __init__(self, bot):
         self.bot = bot
@@ -30,6 +34,7 @@ class tags:
 
     def refresh_indices(self):
         self.indices = { "user-tags": {}, "tag-users":{}, "conv-tags": {}, "tag-convs": {} }
+        self.generation = next(_generations)
 
         self._load_from_memory("user_data", "user")
         self._load_from_memory("conv_data", "conv")
@@ -47,6 +52,7 @@ class tags:
     def add_to_index(self, type, tag, id):
         tag_to_object = "tag-{}s".format(type)
         object_to_tag = "{}-tags".format(type)
+        self.generation = next(_generations)
 
         if tag not in self.indices[tag_to_object]:
             self.indices[tag_to_object][tag] = []
@@ -61,6 +67,7 @@ class tags:
     def remove_from_index(self, type, tag, id):
         tag_to_object = "tag-{}s".format(type)
         object_to_tag = "{}-tags".format(type)
+        self.generation = next(_generations)
 
         if tag in self.indices[tag_to_object]:
             if id in self.indices[tag_to_object][tag]:
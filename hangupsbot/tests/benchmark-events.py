@@ -0,0 +1,140 @@
+"""event construction benchmark: eager (previous) vs lazy, slot-based event classes
+usage: benchmark-events.py [-h] [-n EVENTS] [--log]
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -n EVENTS, --events EVENTS
+                        events created per measurement (default: 100000)
+  --log                 measure with the event log lines enabled (output is discarded)
+
+every event is created and its conv_id and text are read, like a handler that ignores most
+messages would. time is the best of 3 runs, memory is the size of the retained events measured
+with tracemalloc. conversation and user lookups are trivial fakes, so the time saved by not
+looking them up is a lower bound. requires the bot dependencies (hangups) to be installed
+
+example usage:
+python3 benchmark-events.py --log
+"""
+import argparse, datetime, logging, os, sys, time, tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import hangups
+
+import event
+
+
+class LegacyConversationEvent:
+    """copy of the previous, eager event.ConversationEvent"""
+    bot = None
+    emit_log = logging.INFO
+
+    def __init__(self, bot, conv_event):
+        self.bot = bot
+
+        self.conv_event = conv_event
+        self.conv_id = conv_event.conversation_id
+        self.conv = self.bot._conv_list.get(self.conv_id)
+        self.event_id = conv_event.id_
+        self.user_id = conv_event.user_id
+        self.user = self.conv.get_user(self.user_id)
+        self.timestamp = conv_event.timestamp
+        self.text = conv_event.text.strip() if isinstance(conv_event, hangups.ChatMessageEvent) else ''
+
+        self.log()
+
+    def log(self):
+        if event.logger.isEnabledFor(self.emit_log):
+            event.logger.log(self.emit_log, 'eid/dt: {}/{}'.format(self.event_id, self.timestamp.astimezone(tz=None).strftime('%Y-%m-%d %H:%M:%S')))
+            event.logger.log(self.emit_log, 'cid/cn: {}/{}'.format(self.conv_id, self.bot.conversations.get_name(self.conv)))
+            event.logger.log(self.emit_log, 'c/g/un: {}/{}/{}'.format(self.user_id.chat_id, self.user_id.gaia_id, self.user.full_name))
+            event.logger.log(self.emit_log, 'len/tx: {}/{}'.format(len(self.text), self.text))
+
+
+class UserID:
+    chat_id = "1234567890"
+    gaia_id = "1234567890"
+
+
+class User:
+    full_name = "Some User"
+    is_self = False
+
+
+class Conversation:
+    def get_user(self, user_id):
+        return User()
+
+
+class ConversationList:
+    def get(self, conv_id):
+        return Conversation()
+
+
+class Conversations:
+    def get_name(self, conv):
+        return "Some Conversation"
+
+
+class FakeBot:
+    _conv_list = ConversationList()
+    conversations = Conversations()
+
+
+class ChatMessageEvent(hangups.ChatMessageEvent):
+    conversation_id = "UgzAbCdEfGhIjKlMnOp4AaABAQ"
+    id_ = "7-H0Z7-FkyB7-H0Z7-FkyB"
+    user_id = UserID()
+    timestamp = datetime.datetime.now(datetime.timezone.utc)
+    text = "  just a message that no handler cares about  "
+
+    def __init__(self):
+        pass
+
+
+def measure(cls, bot, conv_event, events):
+    seconds = None
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(events):
+            _event = cls(bot, conv_event)
+            _event.conv_id, _event.text
+        seconds = min(seconds or float("inf"), time.perf_counter() - start)
+
+    tracemalloc.start()
+    retained = []
+    for _ in range(events):
+        _event = cls(bot, conv_event)
+        _event.conv_id, _event.text
+        retained.append(_event)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return seconds / events * 1000000, size / events
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--events", type=int, default=100000, help="events created per measurement")
+    parser.add_argument("--log", action="store_true", help="measure with the event log lines enabled")
+    args = parser.parse_args()
+
+    event.logger.setLevel(logging.INFO if args.log else logging.WARNING)
+    event.logger.addHandler(logging.NullHandler())
+    event.logger.propagate = False
+
+    bot = FakeBot()
+    conv_event = ChatMessageEvent()
+
+    print("{} events, event log lines {}".format(args.events, "on" if args.log else "off"))
+    baseline = None
+    for name, cls in (("eager", LegacyConversationEvent),
+                      ("lazy", event.ConversationEvent)):
+        microseconds, size = measure(cls, bot, conv_event, args.events)
+        baseline = baseline or (microseconds, size)
+        print("{:6} {:8.2f} us/event {:6.1f}x {:8.0f} bytes/event {:6.1f}x".format(
+            name, microseconds, baseline[0] / microseconds, size, baseline[1] / size))
+
+
+if __name__ == '__main__':
+    main()
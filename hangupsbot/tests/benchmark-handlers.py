@@ -0,0 +1,167 @@
+"""handler dispatch benchmark: legacy run_pluggable_omnibus vs compiled HandlerRecords
+usage: benchmark-handlers.py [-h] [-p HANDLERS] [-n EVENTS] [--debug]
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -p HANDLERS, --handlers HANDLERS
+                        number of registered message handlers (default: 30)
+  -n EVENTS, --events EVENTS
+                        events dispatched per measurement (default: 20000)
+  --debug               measure with debug logging enabled (output is discarded)
+
+"legacy" is the previous dispatch loop, which inspected every handler and formatted its log
+message for every event. "in-handler check" and "filtered" dispatch a message that no handler
+is interested in: the handlers search a regex themselves or declare it as a filter.
+requires the bot dependencies (hangups) to be installed
+
+example usage:
+python3 benchmark-handlers.py --handlers 30
+"""
+import argparse, asyncio, inspect, logging, os, re, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import handlers
+from exceptions import HangupsBotExceptions
+
+
+logger = logging.getLogger("handlers")
+
+
+class FakeBot:
+    Exceptions = HangupsBotExceptions()
+
+    def register_shared(self, *args, **kwargs):
+        pass
+
+    def get_config_option(self, option):
+        return None
+
+
+@asyncio.coroutine
+def legacy_run_pluggable_omnibus(self, name, *args, **kwargs):
+    if name in self.pluggables:
+        try:
+            for function, priority, plugin_metadata in self.pluggables[name]:
+                message = ["{}: {}.{}".format(
+                            name,
+                            plugin_metadata["module.path"],
+                            function.__name__)]
+
+                try:
+                    _expected = list(inspect.signature(function).parameters)
+                    _passed = args[0:len(_expected)]
+                    if asyncio.iscoroutinefunction(function):
+                        message.append("coroutine")
+                        logger.debug(" : ".join(message))
+                        yield from function(*_passed)
+                    else:
+                        message.append("function")
+                        logger.debug(" : ".join(message))
+                        function(*_passed)
+                except self.bot.Exceptions.SuppressHandler:
+                    message.append("SuppressHandler")
+                    logger.debug(" : ".join(message))
+                    pass
+                except (self.bot.Exceptions.SuppressEventHandling,
+                        self.bot.Exceptions.SuppressAllHandlers):
+                    raise
+                except:
+                    message = " : ".join(message)
+                    logger.exception(message)
+
+        except self.bot.Exceptions.SuppressAllHandlers:
+            message.append("SuppressAllHandlers")
+            logger.debug(" : ".join(message))
+
+
+def make_handlers(count):
+    records = []
+    for index in range(count):
+        if index % 2:
+            def _handler(bot, event, command):
+                event.counter += 1
+        else:
+            def _handler(bot, event):
+                event.counter += 1
+        _handler.__name__ = "_handler{}".format(index)
+        function = asyncio.coroutine(_handler)
+        records.append(handlers.HandlerRecord(function, 50, { "module.path": "plugins.benchmark{}".format(index) }))
+    return records
+
+
+def make_checking_handlers(count, filtered):
+    regex = re.compile("https?://(?:www\\.)?xkcd.com/([0-9]+)", re.IGNORECASE)
+    records = []
+    for index in range(count):
+        if filtered:
+            def _handler(bot, event, command):
+                event.counter += 1
+        else:
+            def _handler(bot, event, command):
+                if regex.search(event.text) is None:
+                    return
+                event.counter += 1
+        _handler.__name__ = "_handler{}".format(index)
+        function = asyncio.coroutine(_handler)
+        records.append(handlers.HandlerRecord(function, 50, { "module.path": "plugins.benchmark{}".format(index) },
+                                              filters={ "regex": regex } if filtered else None))
+    return records
+
+
+class Event:
+    conv_id = "conversation"
+    text = "a message without any link that no handler is interested in"
+    counter = 0
+
+
+def measure(loop, dispatcher, event_handler, events):
+    event = Event()
+
+    @asyncio.coroutine
+    def _run():
+        for _ in range(events):
+            yield from dispatcher(event_handler, "message", event_handler.bot, event, None)
+
+    start = time.perf_counter()
+    loop.run_until_complete(_run())
+    return events / (time.perf_counter() - start), event.counter
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", "--handlers", type=int, default=30, help="number of registered message handlers")
+    parser.add_argument("-n", "--events", type=int, default=20000, help="events dispatched per measurement")
+    parser.add_argument("--debug", action="store_true", help="measure with debug logging enabled")
+    args = parser.parse_args()
+
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(logging.NullHandler())
+        logger.propagate = False
+
+    loop = asyncio.get_event_loop()
+    event_handler = handlers.EventHandler(FakeBot())
+    event_handler.pluggables["message"] = make_handlers(args.handlers)
+
+    print("{} handlers, {} events, debug logging {}".format(
+        args.handlers, args.events, "on" if args.debug else "off"))
+
+    baseline = None
+    for name, dispatcher in (("legacy", legacy_run_pluggable_omnibus),
+                             ("compiled", handlers.EventHandler.run_pluggable_omnibus)):
+        rate, calls = measure(loop, dispatcher, event_handler, args.events)
+        assert calls == args.handlers * args.events
+        baseline = baseline or rate
+        print("{:18} {:10.0f} events/sec {:6.1f}x".format(name, rate, rate / baseline))
+
+    for name, filtered in (("in-handler check", False),
+                           ("filtered", True)):
+        event_handler.pluggables["message"] = make_checking_handlers(args.handlers, filtered)
+        rate, calls = measure(loop, handlers.EventHandler.run_pluggable_omnibus, event_handler, args.events)
+        assert calls == 0
+        print("{:18} {:10.0f} events/sec {:6.1f}x".format(name, rate, rate / baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""memory storage benchmark: json vs binary snapshot
+usage: benchmark-memory.py [-h] [-u USERS] [-c CONVERSATIONS] [-d DIRECTORY]
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -u USERS, --users USERS
+                        number of synthetic users (default: 100000)
+  -c CONVERSATIONS, --conversations CONVERSATIONS
+                        number of synthetic conversations (default: 5000)
+  -d DIRECTORY, --directory DIRECTORY
+                        directory for the test files (default: temporary)
+
+every measurement runs in a fresh python process, so the reported rss (peak resident memory
+of that process) is not skewed by the previous ones
+
+example usage:
+python3 benchmark-memory.py --users 100000
+"""
+import argparse, json, os, random, resource, subprocess, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import config
+
+
+def synthetic_memory(users, conversations):
+    random.seed(users)
+    memory = { "user_data": {}, "convmem": {}, "conv_data": {} }
+
+    for i in range(users):
+        chat_id = str(100000000000000000000 + i)
+        memory["user_data"][chat_id] = {
+            "_hangups": { "first_name": "User", "full_name": "User {}".format(i),
+                          "photo_url": "//lh3.googleusercontent.com/{}/photo.jpg".format(i),
+                          "emails": [ "user{}@example.com".format(i) ],
+                          "is_definitive": True, "updated": "20170101000000" },
+            "nickname": "user{}".format(i),
+            "1on1": "Ugz{:020d}".format(i) }
+
+    for i in range(conversations):
+        conv_id = "Ugx{:020d}".format(i)
+        memory["convmem"][conv_id] = {
+            "title": "conversation {}".format(i), "source": "init", "history": True,
+            "type": random.choice([ "GROUP", "ONE_TO_ONE" ]), "status": "DEFAULT", "link_sharing": False,
+            "participants": [ str(100000000000000000000 + random.randrange(users)) for _ in range(10) ],
+            "updated": "20170101000000" }
+
+    return memory
+
+
+def child(mode, filename):
+    """single measurement, prints the result as json"""
+    start = time.time()
+
+    if mode == "load-json":
+        storage = config.Config(filename)
+    elif mode == "load-binary":
+        storage = config.Config(filename, binary_snapshot=True)
+    elif mode in ("save-json", "save-binary"):
+        storage = config.Config(filename, binary_snapshot=True)
+        start = time.time()
+        storage.binary_snapshot = mode == "save-binary"
+        storage.force_taint()
+        storage.save(delay=False)
+        config.writer.wait(storage)
+
+    interval = time.time() - start
+    print(json.dumps({ "seconds": interval, "rss": peak_rss(), "users": len(storage["user_data"]) }))
+
+
+def peak_rss():
+    """peak resident memory in MB"""
+    try:
+        # ru_maxrss is inherited from the parent process on linux, VmHWM is not
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except IOError:
+        pass
+    # kilobytes on linux, bytes on mac os
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 1024 / 1024 if sys.platform == "darwin" else maxrss / 1024
+
+
+def measure(mode, filename):
+    output = subprocess.check_output([ sys.executable, __file__, "--child", mode, filename ])
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-u", "--users", type=int, default=100000, help="number of synthetic users")
+    parser.add_argument("-c", "--conversations", type=int, default=5000, help="number of synthetic conversations")
+    parser.add_argument("-d", "--directory", help="directory for the test files")
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    directory = args.directory or tempfile.mkdtemp()
+    filename = os.path.join(directory, "memory.json")
+
+    print("generating {} users, {} conversations in {}".format(args.users, args.conversations, filename))
+    config.atomic_write_json(filename, synthetic_memory(args.users, args.conversations))
+
+    results = []
+    for mode in ("save-json", "save-binary", "load-json", "load-binary"):
+        result = measure(mode, filename)
+        results.append((mode, result))
+        if result["users"] != args.users:
+            print("{}: expected {} users, got {}".format(mode, args.users, result["users"]))
+
+    print("json: {:.1f} MB, snapshot: {:.1f} MB".format(
+        os.path.getsize(filename) / 1024 / 1024, os.path.getsize(filename + ".snapshot") / 1024 / 1024))
+    for mode, result in results:
+        print("{:12} {:8.3f}s {:8.1f} MB rss".format(mode, result["seconds"], result["rss"]))
+
+
+if __name__ == '__main__':
+    main()
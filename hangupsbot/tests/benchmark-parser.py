@@ -0,0 +1,136 @@
+"""html to segment rendering: parsing vs the parse cache vs compiled templates
+usage: benchmark-parser.py [-h] [-n MESSAGES]
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -n MESSAGES, --messages MESSAGES
+                        messages rendered per measurement (default: 20000)
+
+first checks that every template rendered with SegmentTemplate.render() gives the same
+segments as the template formatted with html-escaped values and parsed. values contain markup,
+entities and urls, but no line breaks or runs of whitespace, which parsing would change. urls
+are not at the start or end of a value, parsing does not link a url that touches a tag.
+the check runs against the fallback parser and, when hangups has it, against hangups'
+ChatMessageParser, the parser used in production. ChatMessageParser neither unescapes entities
+nor can markup be escaped for it, so it is checked with the values free of markup, unescaped.
+exits with status 1 on the first difference
+
+then measures a mention alert: parsed every time (previous behaviour), parsed with the cache
+hit and rendered from a compiled template. time is the best of 3 runs. requires the bot
+dependencies (hangups) to be installed
+
+example usage:
+python3 benchmark-parser.py -n 100000
+"""
+import argparse, html, os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import parsers
+
+
+templates = [ "{}",
+              "plain {} text",
+              "<b>{}</b>, you cannot @mention anyone until your DND status is toggled off.",
+              "<b>{}</b> @mentioned you in <i>{}</i>:<br />{}",
+              "<b>{0}</b> and <i>{0}</i> and <u>{1}</u>",
+              "{name} said: <b>{text}</b>",
+              "a &amp; b {} &lt;c&gt;",
+              "<b>TL;DR ({} stored):</b>",
+              "{{literal braces}} {}" ]
+
+values = [ "Some User",
+           "<b>not bold</b>",
+           "Tom & Jerry",
+           "a &amp; b",
+           "it's \"quoted\"",
+           "<in a fake tag>",
+           "100% [done]",
+           "ünïcödé",
+           "see http://www.example.com/some/path for details",
+           "look (https://example.com/?a=b). now",
+           "wow https://example.com/x! ok",
+           "visit www.example.com today",
+           "docs at example.org/docs/ now",
+           "get ftp://files.example.com/x here" ]
+
+markup = set("<>&*_~=`[\\")
+
+
+def key(segments):
+    """segment attributes, with adjacent segments of the same kind merged"""
+    merged = []
+    for segment in segments:
+        item = [ segment.text, segment.type_, segment.is_bold, segment.is_italic,
+                 segment.is_strikethrough, segment.is_underline, segment.link_target ]
+        if merged and merged[-1][1:] == item[1:] and segment.text != "\n":
+            merged[-1][0] += segment.text
+        else:
+            merged.append(item)
+    return merged
+
+
+def check(parser):
+    parse = parsers._parsers[parser][0]
+    if parser == "hangups":
+        escape, checked = str, [ value for value in values if not markup & set(value) ]
+    else:
+        escape, checked = html.escape, values
+
+    for template in templates:
+        compiled = parsers.SegmentTemplate(template, parser)
+        fields = template.count("{") - 2 * template.count("{{")
+        for value in checked:
+            args = [ value ] * fields
+            kwargs = { "name": value, "text": value }
+            rendered = compiled.render(*args, **kwargs)
+            parsed = parse(template.format(
+                *[ escape(arg) for arg in args ],
+                **{ name: escape(arg) for name, arg in kwargs.items() }))
+            if key(rendered) != key(parsed):
+                print("{}: mismatch for {!r} with {!r}:\n  parsed:   {!r}\n  rendered: {!r}".format(
+                    parser, template, value, key(parsed), key(rendered)))
+                return False
+    print("{}: {} templates with {} values conform".format(parser, len(templates), len(checked)))
+    return True
+
+
+def measure(function, messages):
+    seconds = None
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(messages):
+            function()
+        seconds = min(seconds or float("inf"), time.perf_counter() - start)
+    return seconds / messages * 1000000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--messages", type=int, default=20000, help="messages rendered per measurement")
+    args = parser.parse_args()
+
+    for parser in ("fallback", "hangups"):
+        if parser not in parsers._parsers:
+            print("{}: not available in this hangups, not checked".format(parser))
+        elif not check(parser):
+            return 1
+
+    template = "<b>{}</b> @mentioned you in <i>{}</i>:<br />{}"
+    arguments = ("Some User", "Some Conversation", "hey @someone, lunch at noon?")
+    formatted = template.format(*arguments)
+    compiled = parsers.compile_template(template)
+
+    baseline = None
+    for name, function in (("parsed", lambda: parsers._parse_to_segments(formatted)),
+                           ("cache hit", lambda: parsers.simple_parse_to_segments(formatted)),
+                           ("template", lambda: compiled.render(*arguments))):
+        microseconds = measure(function, args.messages)
+        baseline = baseline or microseconds
+        print("{:10} {:8.2f} us/message {:6.1f}x".format(name, microseconds, baseline / microseconds))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
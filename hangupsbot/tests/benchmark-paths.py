@@ -0,0 +1,95 @@
+"""memory path lookup microbenchmark: get_by_path/exists vs cached ConfigPath accessors
+usage: benchmark-paths.py [-h] [-u USERS] [-p PARTICIPANTS] [-n NUMBER]
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -u USERS, --users USERS
+                        number of synthetic users (default: 10000)
+  -p PARTICIPANTS, --participants PARTICIPANTS
+                        users looked up per batch, e.g. a conversation (default: 50)
+  -n NUMBER, --number NUMBER
+                        batches per measurement (default: 2000)
+
+half of the users have a nickname, so hits and misses are measured alike. "legacy" is the
+previous functools.reduce based get_by_path() and exception based exists()
+
+example usage:
+python3 benchmark-paths.py
+"""
+import argparse, functools, os, sys, tempfile, timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import config
+
+
+def legacy_get_by_path(memory, keys_list):
+    return functools.reduce(lambda d, k: d[int(k) if isinstance(d, list) else k], keys_list, memory)
+
+
+def legacy_exists(memory, keys_list):
+    _exists = True
+    try:
+        if legacy_get_by_path(memory, keys_list) is None:
+            _exists = False
+    except (KeyError, TypeError):
+        _exists = False
+    return _exists
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-u", "--users", type=int, default=10000, help="number of synthetic users")
+    parser.add_argument("-p", "--participants", type=int, default=50, help="users looked up per batch")
+    parser.add_argument("-n", "--number", type=int, default=2000, help="batches per measurement")
+    args = parser.parse_args()
+
+    memory = config.Config(os.path.join(tempfile.mkdtemp(), "memory.json"))
+    memory.config = { "user_data": { str(i): ({ "nickname": "user{}".format(i) } if i % 2 else {})
+                                     for i in range(args.users) } }
+    chat_ids = [ str(i) for i in range(0, args.users, max(1, args.users // args.participants)) ][:args.participants]
+
+    def _legacy():
+        nicknames = {}
+        for chat_id in chat_ids:
+            if legacy_exists(memory, ["user_data", chat_id, "nickname"]):
+                nicknames[chat_id] = legacy_get_by_path(memory, ["user_data", chat_id, "nickname"])
+        return nicknames
+
+    def _current():
+        nicknames = {}
+        for chat_id in chat_ids:
+            if memory.exists(["user_data", chat_id, "nickname"]):
+                nicknames[chat_id] = memory.get_by_path(["user_data", chat_id, "nickname"])
+        return nicknames
+
+    def _accessor():
+        nickname = memory.path("user_data", "*", "nickname")
+        nicknames = {}
+        for chat_id in chat_ids:
+            value = nickname.get(chat_id)
+            if value is not None:
+                nicknames[chat_id] = value
+        return nicknames
+
+    def _batch():
+        return memory.path("user_data", "*", "nickname").get_many(chat_ids)
+
+    expected = _legacy()
+    assert _current() == expected and _accessor() == expected
+    assert { k: v for k, v in _batch().items() if v is not None } == expected
+
+    print("{} users, {} lookups per batch, {} batches".format(args.users, len(chat_ids), args.number))
+    baseline = None
+    for name, function in (("legacy exists+get_by_path", _legacy),
+                           ("exists+get_by_path", _current),
+                           ("path().get", _accessor),
+                           ("path().get_many", _batch)):
+        seconds = min(timeit.repeat(function, number=args.number, repeat=3))
+        baseline = baseline or seconds
+        print("{:28} {:8.2f} us/batch {:6.1f}x".format(
+            name, seconds / args.number * 1000000, baseline / seconds))
+
+
+if __name__ == '__main__':
+    main()
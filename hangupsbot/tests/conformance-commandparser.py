@@ -0,0 +1,134 @@
+"""conformance test: commandparser.split() vs shlex.split(posix=False)
+usage: conformance-commandparser.py [-h] [-n CASES] [-s SEED] [--benchmark]
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -n CASES, --cases CASES
+                        number of random command lines (default: 100000)
+  -s SEED, --seed SEED  random seed (default: 0)
+  --benchmark           also measure both tokenizers
+
+tokens and errors must be identical for a fixed set of command lines and for random lines built
+from words, quotes and whitespace. CommandParser.parse() is compared with the previous alias
+check, text.split()[0].lower(), followed by shlex.split() of the text with non-breaking spaces
+replaced. exits with status 1 on the first difference
+
+example usage:
+python3 conformance-commandparser.py -n 500000
+"""
+import argparse, os, random, shlex, sys, timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import commandparser
+
+
+fixed = [ "",
+          " ",
+          "/bot",
+          "/bot help",
+          "  /bot   help  \t me\n",
+          "/bot echo \"hello world\"",
+          "/bot echo 'hello world'",
+          "/bot echo \"hello 'nested' world\"",
+          "/bot echo 'it''s'",
+          "/bot echo \"a b\"c d",
+          "/bot echo a\"b c\"",
+          "/bot echo a'b",
+          "/bot echo \"unclosed",
+          "/bot echo 'unclosed",
+          "/bot echo \"\"",
+          "/bot echo \"\" ''",
+          "/bot echo \"multi\nline\"",
+          "/bot echo back\\slash \\\"escaped\\\"",
+          "/bot echo # not a comment",
+          "/bot echo tab\tseparated\rcarriage",
+          "/bot echo form\x0cfeed vertical\x0btab",
+          "/bot echo unicode\u2003em\u00a0space",
+          "/bot echo ünïcödé \"quoted ünïcödé\"",
+          "/bot echo ;|&<>()",
+          "/BOT Help",
+          "\"/bot\" help",
+          "/bot\"x y\"",
+          "\u2003 /bot help",
+          "/bot\u2003help",
+          "\u00a0/bot\u00a0help \"unclosed",
+          "hello \"unclosed" ]
+
+alphabet = [ "a", "b", "/bot", "help", " ", "  ", "\t", "\n", "\r", "\"", "'", "\\", "#", ";", "\x0b", "\u2003", "\u00a0", "é" ]
+
+
+def shlex_split(text):
+    try:
+        return shlex.split(text, posix=False)
+    except ValueError as e:
+        return "ValueError: {}".format(e)
+
+
+def parser_split(text):
+    try:
+        return commandparser.split(text)
+    except ValueError as e:
+        return "ValueError: {}".format(e)
+
+
+def legacy_parse(aliases, text):
+    words = text.split()
+    if not words or words[0].lower() not in aliases:
+        return None
+    return shlex_split(text.replace("\xa0", " "))
+
+
+def parser_parse(parser, text):
+    try:
+        return parser.parse(text.replace("\xa0", " "))
+    except ValueError as e:
+        return "ValueError: {}".format(e)
+
+
+def check(parser, aliases, text):
+    expected, actual = shlex_split(text), parser_split(text)
+    if expected != actual:
+        print("split mismatch for {!r}:\n  shlex:  {!r}\n  parser: {!r}".format(text, expected, actual))
+        return False
+    expected, actual = legacy_parse(aliases, text), parser_parse(parser, text)
+    if expected != actual:
+        print("parse mismatch for {!r}:\n  previous: {!r}\n  parser:   {!r}".format(text, expected, actual))
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--cases", type=int, default=100000, help="number of random command lines")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--benchmark", action="store_true", help="also measure both tokenizers")
+    args = parser.parse_args()
+
+    aliases = ["/bot", "/help"]
+    command_parser = commandparser.CommandParser(aliases)
+
+    for text in fixed:
+        if not check(command_parser, aliases, text):
+            return 1
+
+    generator = random.Random(args.seed)
+    for _ in range(args.cases):
+        text = "".join(generator.choice(alphabet) for _ in range(generator.randint(0, 20)))
+        if not check(command_parser, aliases, text):
+            return 1
+
+    print("{} fixed and {} random command lines conform".format(len(fixed), args.cases))
+
+    if args.benchmark:
+        line = "/bot remind 15 \"take out the trash\" and 'feed the cat' now"
+        for name, function in (("shlex.split", lambda: shlex.split(line, posix=False)),
+                               ("commandparser.split", lambda: commandparser.split(line))):
+            seconds = min(timeit.repeat(function, number=20000, repeat=3))
+            print("{:20} {:8.2f} us/line".format(name, seconds / 20000 * 1000000))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,168 @@
+"""conformance test: memory reloaded from the file and its journal vs the memory that was saved
+usage: conformance-journal.py [-h] [-d DIRECTORY] [-v]
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -d DIRECTORY, --directory DIRECTORY
+                        directory for the test files (default: temporary)
+  -v, --verbose         show the log of the storage
+
+every case changes a journalled Config, saves it and then "crashes": the files are loaded into
+a fresh Config without flush(). the loaded data must equal the data at the last completed
+save. the cases run with the json file and with the binary snapshot:
+  set, pop, item assignment/deletion and in-place changes of get_by_path() results
+  the same journal replayed twice
+  a compaction interrupted after the new file was written, before the segments were removed
+  a compaction interrupted before the new file was written
+  a partially written journal entry
+exits with status 1 on the first difference
+
+example usage:
+python3 conformance-journal.py
+"""
+import argparse, json, logging, os, sys, tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import config
+
+
+def open_memory(directory, binary_snapshot):
+    return config.Config(os.path.join(directory, "memory.json"), journal=True, binary_snapshot=binary_snapshot)
+
+
+def saved(memory):
+    """save, wait for the writer and return a copy of the saved data"""
+    memory.save(delay=False)
+    config.writer.wait(memory)
+    return json.loads(json.dumps(memory.config))
+
+
+def conforms(case, expected, directory, binary_snapshot):
+    loaded = json.loads(json.dumps(open_memory(directory, binary_snapshot).config))
+    if loaded != expected:
+        print("{}: mismatch\n  saved:  {!r}\n  loaded: {!r}".format(case, expected, loaded))
+        return False
+    return True
+
+
+def case_changes(directory, binary_snapshot):
+    memory = open_memory(directory, binary_snapshot)
+    memory["user_data"] = {}
+    memory.set_by_path(["user_data", "1"], { "nickname": "a" })
+    saved(memory)
+
+    memory.get_by_path(["user_data", "1"])["nickname"] = "b"
+    memory["misc"] = [ 1 ]
+    memory.get_by_path(["misc"]).append(2)
+    memory.set_by_path(["user_data", "2"], { "nickname": "c", "tags": [] })
+    saved(memory)
+
+    memory.pop_by_path(["user_data", "1"])
+    memory.get_by_path(["user_data", "2", "tags"]).append("admin")
+    del memory["misc"]
+    memory["conv_data"] = { "x": { "y": 1 } }
+    memory.get_by_path(["conv_data", "x"])["y"] = 2
+    expected = saved(memory)
+
+    # not saved, lost in the crash
+    memory.set_by_path(["user_data", "3"], {})
+
+    return (conforms("changes", expected, directory, binary_snapshot)
+            and conforms("changes replayed again", expected, directory, binary_snapshot))
+
+
+def case_compacted(directory, binary_snapshot):
+    memory = open_memory(directory, binary_snapshot)
+    memory.set_by_path(["a"], { "k": 1 })
+    memory.set_by_path(["queue"], [ 1, 2, 3 ])
+    memory.force_taint()
+    saved(memory)
+
+    # replayed over the compacted file, where the item is already gone
+    memory.pop_by_path(["queue", 0])
+    saved(memory)
+
+    # only in the compacted file, not in the journal segment
+    memory.set_by_path(["a", "k"], 2)
+    memory.force_taint()
+
+    remove = os.remove
+    os.remove = lambda filename: None if ".journal." in filename else remove(filename)
+    try:
+        expected = saved(memory)
+    finally:
+        os.remove = remove
+
+    if not memory._journal_segments():
+        print("compacted: no journal segment left behind")
+        return False
+
+    return conforms("compacted, segments left behind", expected, directory, binary_snapshot)
+
+
+def case_not_compacted(directory, binary_snapshot):
+    memory = open_memory(directory, binary_snapshot)
+    memory.set_by_path(["a"], { "k": 1 })
+    memory.set_by_path(["b"], 1)
+    expected = saved(memory)
+
+    memory.set_by_path(["a", "k"], 2)
+    memory.pop_by_path(["b"])
+    memory.force_taint()
+
+    def failing(filename, content):
+        raise OSError("crashed before {} was replaced".format(filename))
+
+    atomic_write = config.atomic_write
+    config.atomic_write = failing
+    try:
+        saved(memory)
+    finally:
+        config.atomic_write = atomic_write
+
+    return conforms("compaction interrupted", expected, directory, binary_snapshot)
+
+
+def case_torn(directory, binary_snapshot):
+    memory = open_memory(directory, binary_snapshot)
+    memory.set_by_path(["a"], { "k": 1 })
+    expected = saved(memory)
+
+    with open(memory._journal_filename(), "a") as f:
+        f.write('["set", ["a", "k"], ')
+
+    if not conforms("partial entry", expected, directory, binary_snapshot):
+        return False
+
+    # appended after the truncated entry
+    memory = open_memory(directory, binary_snapshot)
+    memory.set_by_path(["a", "k"], 3)
+    expected = saved(memory)
+    return conforms("appended after partial entry", expected, directory, binary_snapshot)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--directory", help="directory for the test files (default: temporary)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the log of the storage")
+    args = parser.parse_args()
+
+    # the interrupted compaction logs a write failure
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+        for binary_snapshot in (False, True):
+            for case in (case_changes, case_compacted, case_not_compacted, case_torn):
+                name = "{}-{}".format(case.__name__, "binary" if binary_snapshot else "json")
+                case_directory = os.path.join(directory, name)
+                os.makedirs(case_directory)
+                if not case(case_directory, binary_snapshot):
+                    return 1
+                print("{}: conforms".format(name))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())